@@ -14,11 +14,363 @@ testing directly! You may, however, add new private attributes, methods, and
 top-level functions to this file.
 """
 from __future__ import annotations
+import asyncio
 import csv
-from typing import Any, Dict, List, Optional, Tuple
+import os
+import re
+import threading
+from collections import OrderedDict
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, \
+    ThreadPoolExecutor
+from typing import Any, Callable, Dict, Hashable, Iterable, Iterator, List, \
+    Optional, Tuple, Union
 
 from melody import Melody
-from prefix_tree import SimplePrefixTree, CompressedPrefixTree
+from prefix_tree import Autocompleter, SimplePrefixTree, CompressedPrefixTree, \
+    ConcurrentAutocompleter, DecayingAutocompleter, MappedPrefixTree, \
+    PrefixCursor
+
+# Sanitizing keeps exactly the characters c with c.isalnum() or c == ' ': \w
+# matches the alphanumeric characters and the underscore.
+_UNSANITARY = re.compile(r'[^\w ]|_')
+# The same, but also keeping the newlines between the lines of a chunk.
+_UNSANITARY_LINES = re.compile(r'[^\w \n]|_')
+# The number of characters of a file that are sanitized together.
+_CHUNK_SIZE = 1 << 16
+
+
+def _make_autocompleter(config: Dict[str, Any],
+                        items: Iterable[Tuple[Any, float, List]]) \
+        -> Autocompleter:
+    """Return the Autocompleter described by an engine's <config>, holding the
+    (value, weight, prefix) triples in <items>.
+    """
+    if config['autocompleter'] == 'simple':
+        tree_class = SimplePrefixTree
+    else:
+        tree_class = CompressedPrefixTree
+    tree = tree_class.from_items(config['weight_type'], items,
+                                 config.get('top_k'))
+    if config.get('half_life') is not None:
+        return DecayingAutocompleter(tree, config['half_life'])
+    elif config.get('concurrent'):
+        return ConcurrentAutocompleter(tree)
+    return tree
+
+
+def _make_cache(config: Dict[str, Any]) -> Optional[QueryCache]:
+    """Return the QueryCache described by an engine's <config>, or None if
+    it does not ask for one.
+
+    Weights that decay would go stale in the cache, so there is no cache
+    when <config> has a 'half_life'.
+    """
+    if config.get('cache_entries') is None or \
+            config.get('half_life') is not None:
+        return None
+    return QueryCache(config['cache_entries'], config.get('cache_size'))
+
+
+def _sanitize(text: str) -> str:
+    """Return <text> in lowercase, keeping only its alphanumeric characters
+    and spaces.
+    """
+    return _UNSANITARY.sub('', text.lower())
+
+
+def _sanitize_line(line: str) -> str:
+    """Return <line>, a line of a LetterAutocompleteEngine's file, sanitized
+    as the file is loaded: only its alphanumeric characters and spaces are
+    kept, and they are then put in lowercase.
+
+    Unlike _sanitize, this keeps the lowercase form of a character even when
+    that form is not alphanumeric, as with '\u0130' (capital I with a dot).
+    """
+    return _UNSANITARY.sub('', line).lower()
+
+
+def _sanitize_lines(lines: Iterable[str]) -> Iterator[str]:
+    """Yield each of <lines>, the lines of a file, sanitized by
+    _sanitize_line.
+
+    The lines are sanitized in chunks of about _CHUNK_SIZE characters, with a
+    single pass over each chunk.
+
+    Precondition: '\n' only appears at the end of each of <lines>.
+    """
+    chunk = []
+    size = 0
+    for line in lines:
+        chunk.append(line)
+        size += len(line)
+        if size >= _CHUNK_SIZE:
+            yield from _sanitize_chunk(chunk)
+            chunk = []
+            size = 0
+    yield from _sanitize_chunk(chunk)
+
+
+def _sanitize_chunk(lines: List[str]) -> List[str]:
+    """Return each of <lines> sanitized, as described in _sanitize_lines."""
+    if not lines:
+        return []
+    text = ''.join(lines)
+    if not lines[-1].endswith('\n'):
+        text += '\n'
+    return _UNSANITARY_LINES.sub('', text).lower().split('\n')[:-1]
+
+
+def _letter_items(lines: Iterable[str]) \
+        -> Iterator[Tuple[str, float, List[str]]]:
+    """Yield the (value, weight, prefix) triple for each of <lines> that
+    LetterAutocompleteEngine inserts, reading <lines> a chunk at a time.
+
+    A line is sanitized, and skipped unless it contains at least one
+    alphanumeric character. Its value is the sanitized line without leading
+    and trailing spaces, and its prefix is every character of the sanitized
+    line.
+    """
+    for line in _sanitize_lines(lines):
+        value = line.strip()
+        if value:
+            yield value, 1.0, list(line)
+
+
+def _sentence_weights(lines: Iterable[str]) -> Dict[str, List[float]]:
+    """Return a dictionary mapping each string that SentenceAutocompleteEngine
+    inserts from the CSV <lines> to the weights it is inserted with, in the
+    order of <lines>.
+    """
+    weights = {}
+    for line in csv.reader(lines):
+        value = _sanitize(line[0])
+        if value.split():
+            weights.setdefault(value, []).append(float(line[1]))
+    return weights
+
+
+def _sentence_weights_in_range(path: str, start: int,
+                               end: int) -> Dict[str, List[float]]:
+    """Return _sentence_weights for the lines of the CSV file <path> that start
+    at a byte offset in [<start>, <end>).
+
+    Each process of a parallel load runs this on its own range of the file.
+    """
+    lines = []
+    with open(path, 'rb') as f:
+        if start > 0:
+            # Skip the rest of the line that the previous range finishes.
+            f.seek(start - 1)
+            f.readline()
+        while f.tell() < end:
+            line = f.readline()
+            if not line:
+                break
+            lines.append(line.decode('utf8'))
+    return _sentence_weights(lines)
+
+
+def _sentence_weights_parallel(path: str,
+                               workers: int) -> Dict[str, List[float]]:
+    """Return _sentence_weights for the lines of the CSV file <path>, parsed by
+    <workers> processes that each handle one byte range of the file.
+    """
+    size = os.path.getsize(path)
+    bounds = [size * i // workers for i in range(workers + 1)]
+    weights = {}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        # map returns the ranges in file order, so every list of weights ends
+        # up in the same order as in a sequential load.
+        for range_weights in pool.map(_sentence_weights_in_range,
+                                      [path] * workers, bounds[:-1],
+                                      bounds[1:]):
+            for value, value_weights in range_weights.items():
+                weights.setdefault(value, []).extend(value_weights)
+    return weights
+
+
+def _sentence_items(weights: Dict[str, List[float]]) \
+        -> Iterator[Tuple[str, float, List[str]]]:
+    """Yield the (value, weight, prefix) triple for each string in <weights>,
+    whose weight is the sum of its weights.
+
+    The weights are added up one at a time in order, as repeated inserts
+    would, so the totals are exactly the same as theirs.
+    """
+    for value, value_weights in weights.items():
+        total = value_weights[0]
+        for weight in value_weights[1:]:
+            total = total + weight
+        yield value, total, value.split()
+
+
+################################################################################
+# Query cache
+################################################################################
+class QueryCache:
+    """A least-recently-used cache of the results of autocomplete queries,
+    keyed on their prefix sequence and limit.
+
+    When values are inserted or removed, only the entries whose results they
+    can change are dropped.
+
+    === Attributes ===
+    max_entries: The most entries the cache holds.
+    max_size: The most results, over all entries, that the cache holds, or
+        None if only the number of entries is bounded.
+    hits: The number of queries answered from the cache.
+    misses: The number of queries that were not in the cache.
+    evictions: The number of entries dropped to keep the cache within its
+        bounds.
+
+    === Private Attributes ===
+    _entries:
+        Maps the (prefix, limit) of each entry, with prefix as a tuple, to its
+        results, from the least to the most recently used.
+    _size: The number of results, over all entries, in the cache.
+    _prefixes:
+        A prefix tree of the prefixes of the entries, as nested dictionaries:
+        each dictionary maps an element to the dictionary for the prefix
+        extended by that element, and maps None to the set of limits cached
+        for its own prefix (if there are any).
+    _generation:
+        The number of times entries have been invalidated, so that results
+        computed before an invalidation are not stored after it.
+    _lock: The lock held while the cache is used, so that threads can share
+        it.
+    """
+    max_entries: int
+    max_size: Optional[int]
+    hits: int
+    misses: int
+    evictions: int
+    _entries: OrderedDict
+    _size: int
+    _prefixes: Dict[Any, Any]
+    _generation: int
+    _lock: threading.Lock
+
+    def __init__(self, max_entries: int,
+                 max_size: Optional[int] = None) -> None:
+        """Initialize an empty cache of up to <max_entries> entries and, if
+        <max_size> is not None, up to <max_size> results.
+
+        Precondition: max_entries > 0 and (max_size is None or max_size > 0)
+        """
+        self.max_entries = max_entries
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._size = 0
+        self._prefixes = {}
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        """Return the number of entries in the cache."""
+        return len(self._entries)
+
+    def fetch(self, prefix: List, limit: Optional[int],
+              autocomplete: Callable[[List, Optional[int]],
+                                     List[Tuple[Any, float]]]) \
+            -> List[Tuple[Any, float]]:
+        """Return the results for <prefix> and <limit>, from the cache if it
+        has them, or else from autocomplete(prefix, limit), which are then
+        cached.
+        """
+        key = (tuple(prefix), limit)
+        with self._lock:
+            results = self._entries.get(key)
+            if results is not None:
+                self.hits += 1
+                self._entries.move_to_end(key)
+                return list(results)
+            self.misses += 1
+            generation = self._generation
+        results = autocomplete(prefix, limit)
+        with self._lock:
+            if generation == self._generation and key not in self._entries \
+                    and (self.max_size is None or
+                         len(results) <= self.max_size):
+                self._entries[key] = list(results)
+                self._size += len(results)
+                self._link(key)
+                self._evict()
+        return results
+
+    def invalidate_path(self, prefix: List) -> None:
+        """Drop every entry whose prefix is a prefix of <prefix>, as a value
+        with <prefix> has been inserted.
+        """
+        with self._lock:
+            self._generation += 1
+            node = self._prefixes
+            for i in range(len(prefix) + 1):
+                self._drop(tuple(prefix[:i]), node.get(None, ()))
+                if i == len(prefix) or prefix[i] not in node:
+                    break
+                node = node[prefix[i]]
+
+    def invalidate_under(self, prefix: List) -> None:
+        """Drop every entry whose prefix is a prefix of <prefix> or starts
+        with <prefix>, as the values that match <prefix> have been removed.
+        """
+        with self._lock:
+            self._generation += 1
+            node = self._prefixes
+            for i in range(len(prefix)):
+                self._drop(tuple(prefix[:i]), node.get(None, ()))
+                if prefix[i] not in node:
+                    return
+                node = node[prefix[i]]
+            stack = [(tuple(prefix), node)]
+            while stack:
+                path, node = stack.pop()
+                for element, child in node.items():
+                    if element is not None:
+                        stack.append((path + (element,), child))
+                self._drop(path, node.get(None, ()))
+
+    def _drop(self, prefix: tuple, limits: Iterable[Optional[int]]) -> None:
+        """Drop the entries for <prefix> with each of <limits>."""
+        for limit in list(limits):
+            self._unlink((prefix, limit))
+            self._size -= len(self._entries.pop((prefix, limit)))
+
+    def _evict(self) -> None:
+        """Drop the least recently used entries until the cache is within its
+        bounds.
+        """
+        while len(self._entries) > self.max_entries or \
+                (self.max_size is not None and self._size > self.max_size):
+            key, results = self._entries.popitem(last=False)
+            self._unlink(key)
+            self._size -= len(results)
+            self.evictions += 1
+
+    def _link(self, key: Tuple[tuple, Optional[int]]) -> None:
+        """Record the entry <key> in self._prefixes."""
+        node = self._prefixes
+        for element in key[0]:
+            node = node.setdefault(element, {})
+        node.setdefault(None, set()).add(key[1])
+
+    def _unlink(self, key: Tuple[tuple, Optional[int]]) -> None:
+        """Remove the entry <key> from self._prefixes, along with the
+        dictionaries that no longer lead to any entry.
+        """
+        path = [self._prefixes]
+        for element in key[0]:
+            path.append(path[-1][element])
+        path[-1][None].discard(key[1])
+        if not path[-1][None]:
+            del path[-1][None]
+        for i in range(len(key[0]) - 1, -1, -1):
+            if path[i + 1]:
+                break
+            del path[i][key[0][i]]
 
 
 ################################################################################
@@ -36,8 +388,11 @@ class LetterAutocompleteEngine:
 
     === Attributes ===
     autocompleter: An Autocompleter used by this engine.
+    cache: The cache of this engine's query results, or None if it does not
+        cache them.
     """
     autocompleter: Autocompleter
+    cache: Optional[QueryCache]
 
     def __init__(self, config: Dict[str, Any]) -> None:
         """Initialize this engine with the given configuration.
@@ -46,8 +401,23 @@ class LetterAutocompleteEngine:
             - 'file': the path to a text file
             - 'autocompleter': either the string 'simple' or 'compressed',
               specifying which subclass of Autocompleter to use.
-            - 'weight_type': either 'sum' or 'average', which specifies the
+            - 'weight_type': 'sum', 'average' or 'max', which specifies the
               weight type for the prefix tree.
+            - 'top_k' (optional): if given, the prefix tree caches this many
+              top results at every internal node.
+            - 'concurrent' (optional): if true, the prefix tree is wrapped in
+              a ConcurrentAutocompleter, so that threads can query it without
+              locking while another thread changes it.
+            - 'half_life' (optional): if given, the prefix tree is wrapped in
+              a DecayingAutocompleter, so that weights halve every this many
+              seconds, and 'concurrent' and 'cache_entries' are ignored.
+            - 'cache_entries' (optional): if given, the engine keeps the
+              results of up to this many recent queries in a QueryCache.
+            - 'cache_size' (optional): if given along with 'cache_entries',
+              the most results, over all queries, that the cache keeps.
+            - 'snapshot' (optional): if given, the path to a snapshot written
+              by SimplePrefixTree.save. The engine then answers queries from
+              a read-only MappedPrefixTree and does not read 'file'.
 
         Each line of the specified file counts as one input string.
         Note that the line may or may not contain spaces.
@@ -62,27 +432,17 @@ class LetterAutocompleteEngine:
         one line of the input file; this would result in that string getting
         a larger weight (because of how Autocompleter.insert works).
         """
+        self.cache = _make_cache(config)
+        if config.get('snapshot') is not None:
+            self.autocompleter = MappedPrefixTree.load(config['snapshot'])
+            return
         # We've opened the file for you here. You should iterate over the
         # lines of the file and process them according to the description in
         # this method's docstring.
-        if config['autocompleter'] == 'simple':
-            self.autocompleter = SimplePrefixTree(config['weight_type'])
-        else:
-            self.autocompleter = CompressedPrefixTree(config['weight_type'])
+        # The lines are read, sanitized and added to the tree one at a time,
+        # so the file is never held in memory as a whole.
         with open(config['file'], encoding='utf8') as f:
-            temp = f.readlines()
-        for i in range(len(temp)):
-            temp[i] = ''.join(c for c in temp[i] if c.isalnum() or c == ' ')
-            temp[i] = temp[i].lower()
-
-        inserted_value_list = []
-        for item in temp:
-            inserted_value_list.append((item.strip(), [c for c in item]))
-        for inserted_value in inserted_value_list:
-            if inserted_value[1] and \
-                    not all([c == ' ' for c in inserted_value[1]]):
-                self.autocompleter.insert(
-                    inserted_value[0], 1.0, inserted_value[1])
+            self.autocompleter = _make_autocompleter(config, _letter_items(f))
 
     def autocomplete(self, prefix: str,
                      limit: Optional[int] = None) -> List[Tuple[str, float]]:
@@ -100,9 +460,30 @@ class LetterAutocompleteEngine:
             limit is None or limit > 0
             <prefix> contains only lowercase alphanumeric characters and spaces
         """
-        prefix = prefix.lower()
-        prefix = [c for c in prefix if c.isalnum() or c == ' ']
-        return self.autocompleter.autocomplete([c for c in prefix], limit)
+        prefix = list(_sanitize(prefix))
+        if self.cache is None:
+            return self.autocompleter.autocomplete(prefix, limit)
+        return self.cache.fetch(prefix, limit, self.autocompleter.autocomplete)
+
+    def autocomplete_many(self, prefixes: List[str],
+                          limit: Optional[int] = None) \
+            -> List[List[Tuple[str, float]]]:
+        """Return the result of self.autocomplete(prefix, limit) for each
+        prefix string in <prefixes>, in the same order as <prefixes>.
+
+        Preconditions:
+            limit is None or limit > 0
+            each prefix contains only lowercase alphanumeric characters and
+            spaces
+        """
+        return self.autocompleter.autocomplete_many(
+            [list(_sanitize(prefix)) for prefix in prefixes], limit)
+
+    def session(self) -> LetterSession:
+        """Return a new LetterSession over this engine, with nothing typed
+        yet.
+        """
+        return LetterSession(self.autocompleter.cursor())
 
     def remove(self, prefix: str) -> None:
         """Remove all strings that match the given prefix string.
@@ -113,9 +494,82 @@ class LetterAutocompleteEngine:
         Precondition: <prefix> contains only lowercase alphanumeric characters
                       and spaces.
         """
-        prefix = prefix.lower()
-        prefix = [c for c in prefix if c.isalnum() or c == ' ']
-        return self.autocompleter.remove([c for c in prefix])
+        prefix = list(_sanitize(prefix))
+        self.autocompleter.remove(prefix)
+        if self.cache is not None:
+            self.cache.invalidate_under(prefix)
+
+    def remove_many(self, prefixes: List[str]) -> None:
+        """Remove all strings that match any of the given prefix strings.
+
+        Precondition: each prefix contains only lowercase alphanumeric
+                      characters and spaces.
+        """
+        prefixes = [list(_sanitize(prefix)) for prefix in prefixes]
+        self.autocompleter.remove_many(prefixes)
+        if self.cache is not None:
+            for prefix in prefixes:
+                self.cache.invalidate_under(prefix)
+
+    def insert(self, string: str, weight: float = 1.0) -> None:
+        """Insert <string> with the given weight, as if it were a line of the
+        engine's file that was read <weight> times.
+
+        Like the lines of the file, <string> is sanitized, and skipped if it
+        does not contain at least one alphanumeric character.
+
+        Precondition: weight > 0
+        """
+        line = _sanitize_line(string)
+        value = line.strip()
+        if value:
+            self.autocompleter.insert(value, weight, list(line))
+            if self.cache is not None:
+                self.cache.invalidate_path(list(line))
+
+
+class LetterSession:
+    """A type-ahead session in a LetterAutocompleteEngine, whose prefix is
+    typed and erased one character at a time.
+
+    Each character is sanitized as it is typed, and the session's cursor
+    carries on from where the previous keystroke left it.
+
+    === Private Attributes ===
+    _cursor: The cursor at the sanitized prefix typed so far.
+    _typed:
+        For each character typed and not yet erased, the number of letters
+        it added to the cursor's prefix once sanitized.
+    """
+    _cursor: PrefixCursor
+    _typed: List[int]
+
+    def __init__(self, cursor: PrefixCursor) -> None:
+        """Initialize a session that types into <cursor>."""
+        self._cursor = cursor
+        self._typed = []
+
+    def type(self, char: str) -> None:
+        """Type the character <char>."""
+        letters = _sanitize(char)
+        for letter in letters:
+            self._cursor.advance(letter)
+        self._typed.append(len(letters))
+
+    def erase(self) -> None:
+        """Erase the last character typed, if there is one."""
+        if self._typed:
+            for _ in range(self._typed.pop()):
+                self._cursor.retreat()
+
+    def autocomplete(self, limit: Optional[int] = None) \
+            -> List[Tuple[str, float]]:
+        """Return up to <limit> matches for the text typed so far, as
+        LetterAutocompleteEngine.autocomplete would.
+
+        Precondition: limit is None or limit > 0.
+        """
+        return self._cursor.autocomplete(limit)
 
 
 class SentenceAutocompleteEngine:
@@ -131,8 +585,11 @@ class SentenceAutocompleteEngine:
 
     === Attributes ===
     autocompleter: An Autocompleter used by this engine.
+    cache: The cache of this engine's query results, or None if it does not
+        cache them.
     """
     autocompleter: Autocompleter
+    cache: Optional[QueryCache]
 
     def __init__(self, config: Dict[str, Any]) -> None:
         """Initialize this engine with the given configuration.
@@ -141,8 +598,26 @@ class SentenceAutocompleteEngine:
             - 'file': the path to a CSV file
             - 'autocompleter': either the string 'simple' or 'compressed',
               specifying which subclass of Autocompleter to use.
-            - 'weight_type': either 'sum' or 'average', which specifies the
+            - 'weight_type': 'sum', 'average' or 'max', which specifies the
               weight type for the prefix tree.
+            - 'top_k' (optional): if given, the prefix tree caches this many
+              top results at every internal node.
+            - 'concurrent' (optional): if true, the prefix tree is wrapped in
+              a ConcurrentAutocompleter, so that threads can query it without
+              locking while another thread changes it.
+            - 'half_life' (optional): if given, the prefix tree is wrapped in
+              a DecayingAutocompleter, so that weights halve every this many
+              seconds, and 'concurrent' and 'cache_entries' are ignored.
+            - 'cache_entries' (optional): if given, the engine keeps the
+              results of up to this many recent queries in a QueryCache.
+            - 'cache_size' (optional): if given along with 'cache_entries',
+              the most results, over all queries, that the cache keeps.
+            - 'snapshot' (optional): if given, the path to a snapshot written
+              by SimplePrefixTree.save. The engine then answers queries from
+              a read-only MappedPrefixTree and does not read 'file'.
+            - 'workers' (optional): if greater than one, the file is split
+              into this many byte ranges, which are parsed by as many
+              processes in parallel before the tree is built.
 
         Precondition:
         The given file is a *CSV file* where each line has two entries:
@@ -162,30 +637,20 @@ class SentenceAutocompleteEngine:
         one line of the input file; this would result in that string getting
         a larger weight.
         """
+        self.cache = _make_cache(config)
+        if config.get('snapshot') is not None:
+            self.autocompleter = MappedPrefixTree.load(config['snapshot'])
+            return
         # We haven't given you any starter code here! You should review how
         # you processed CSV files on Assignment 1.
-        if config['autocompleter'] == 'simple':
-            self.autocompleter = SimplePrefixTree(config['weight_type'])
+        workers = config.get('workers')
+        if workers is not None and workers > 1:
+            weights = _sentence_weights_parallel(config['file'], workers)
         else:
-            self.autocompleter = CompressedPrefixTree(config['weight_type'])
-        with open(config['file'], encoding='utf8') as csvfile:
-            temp = []
-            reader = csv.reader(csvfile)
-            for line in reader:
-                temp.append(tuple(map(str, line)))
-        inserted_value_list = []
-        for item in temp:
-            temp_prefix = ''.join(
-                c for c in item[0].lower() if c.isalnum() or c == ' ')
-            inserted_value_list.append((temp_prefix, item[1],
-                                        temp_prefix.split()))
-
-        for inserted_value in inserted_value_list:
-            if inserted_value[2] and not \
-                    all([c == ' ' for c in inserted_value[2]]):
-                self.autocompleter.insert(
-                    inserted_value[0], float(inserted_value[1]),
-                    inserted_value[2])
+            with open(config['file'], encoding='utf8') as csvfile:
+                weights = _sentence_weights(csvfile)
+        self.autocompleter = _make_autocompleter(config,
+                                                 _sentence_items(weights))
 
     def autocomplete(self, prefix: str,
                      limit: Optional[int] = None) -> List[Tuple[str, float]]:
@@ -203,8 +668,24 @@ class SentenceAutocompleteEngine:
             limit is None or limit > 0
             <prefix> contains only lowercase alphanumeric characters and spaces
         """
-        prefix = ''.join(c for c in prefix.lower() if c.isalnum() or c == ' ')
-        return self.autocompleter.autocomplete(prefix.split(), limit)
+        prefix = _sanitize(prefix).split()
+        if self.cache is None:
+            return self.autocompleter.autocomplete(prefix, limit)
+        return self.cache.fetch(prefix, limit, self.autocompleter.autocomplete)
+
+    def autocomplete_many(self, prefixes: List[str],
+                          limit: Optional[int] = None) \
+            -> List[List[Tuple[str, float]]]:
+        """Return the result of self.autocomplete(prefix, limit) for each
+        prefix string in <prefixes>, in the same order as <prefixes>.
+
+        Preconditions:
+            limit is None or limit > 0
+            each prefix contains only lowercase alphanumeric characters and
+            spaces
+        """
+        return self.autocompleter.autocomplete_many(
+            [_sanitize(prefix).split() for prefix in prefixes], limit)
 
     def remove(self, prefix: str) -> None:
         """Remove all strings that match the given prefix.
@@ -215,8 +696,37 @@ class SentenceAutocompleteEngine:
         Precondition: <prefix> contains only lowercase alphanumeric characters
                       and spaces.
         """
-        prefix = ''.join(c for c in prefix.lower() if c.isalnum() or c == ' ')
-        return self.autocompleter.remove(prefix.split())
+        prefix = _sanitize(prefix).split()
+        self.autocompleter.remove(prefix)
+        if self.cache is not None:
+            self.cache.invalidate_under(prefix)
+
+    def remove_many(self, prefixes: List[str]) -> None:
+        """Remove all strings that match any of the given prefixes.
+
+        Precondition: each prefix contains only lowercase alphanumeric
+                      characters and spaces.
+        """
+        prefixes = [_sanitize(prefix).split() for prefix in prefixes]
+        self.autocompleter.remove_many(prefixes)
+        if self.cache is not None:
+            for prefix in prefixes:
+                self.cache.invalidate_under(prefix)
+
+    def insert(self, string: str, weight: float) -> None:
+        """Insert <string> with the given weight, as if it were a line of the
+        engine's file.
+
+        Like the lines of the file, <string> is sanitized, and skipped if it
+        does not contain at least one word.
+
+        Precondition: weight > 0
+        """
+        value = _sanitize(string)
+        if value.split():
+            self.autocompleter.insert(value, weight, value.split())
+            if self.cache is not None:
+                self.cache.invalidate_path(value.split())
 
 
 ################################################################################
@@ -234,8 +744,11 @@ class MelodyAutocompleteEngine:
 
     # === Private Attributes ===
     autocompleter: An Autocompleter used by this engine.
+    cache: The cache of this engine's query results, or None if it does not
+        cache them.
     """
     autocompleter: Autocompleter
+    cache: Optional[QueryCache]
 
     def __init__(self, config: Dict[str, Any]) -> None:
         """Initialize this engine with the given configuration.
@@ -244,8 +757,23 @@ class MelodyAutocompleteEngine:
             - 'file': the path to a CSV file
             - 'autocompleter': either the string 'simple' or 'compressed',
               specifying which subclass of Autocompleter to use.
-            - 'weight_type': either 'sum' or 'average', which specifies the
+            - 'weight_type': 'sum', 'average' or 'max', which specifies the
               weight type for the prefix tree.
+            - 'top_k' (optional): if given, the prefix tree caches this many
+              top results at every internal node.
+            - 'concurrent' (optional): if true, the prefix tree is wrapped in
+              a ConcurrentAutocompleter, so that threads can query it without
+              locking while another thread changes it.
+            - 'half_life' (optional): if given, the prefix tree is wrapped in
+              a DecayingAutocompleter, so that weights halve every this many
+              seconds, and 'concurrent' and 'cache_entries' are ignored.
+            - 'cache_entries' (optional): if given, the engine keeps the
+              results of up to this many recent queries in a QueryCache.
+            - 'cache_size' (optional): if given along with 'cache_entries',
+              the most results, over all queries, that the cache keeps.
+            - 'snapshot' (optional): if given, the path to a snapshot written
+              by SimplePrefixTree.save. The engine then answers queries from
+              a read-only MappedPrefixTree and does not read 'file'.
 
         Precondition:
         The given file is a *CSV file* where each line has the following format:
@@ -260,13 +788,12 @@ class MelodyAutocompleteEngine:
 
         Each melody is be inserted into the Autocompleter with a weight of 1.
         """
+        self.cache = _make_cache(config)
+        if config.get('snapshot') is not None:
+            self.autocompleter = MappedPrefixTree.load(config['snapshot'])
+            return
         # We haven't given you any starter code here! You should review how
         # you processed CSV files on Assignment 1.
-        if config['autocompleter'] == 'simple':
-            self.autocompleter = SimplePrefixTree(config['weight_type'])
-        else:
-            self.autocompleter = CompressedPrefixTree(config['weight_type'])
-
         with open(config['file'], encoding='utf8') as csvfile:
             temp = []
             reader = csv.reader(csvfile)
@@ -287,10 +814,11 @@ class MelodyAutocompleteEngine:
                 interval.append(notes[k + 1][0] - notes[k][0])
             inserted_value_list.append((Melody(item[0], notes), interval))
 
+        items = []
         for inserted_value in inserted_value_list:
             if inserted_value[1]:
-                self.autocompleter.insert(inserted_value[0], 1.0,
-                                          inserted_value[1])
+                items.append((inserted_value[0], 1.0, inserted_value[1]))
+        self.autocompleter = _make_autocompleter(config, items)
 
     def autocomplete(self, prefix: List[int],
                      limit: Optional[int] = None) -> List[Tuple[Melody, float]]:
@@ -304,12 +832,274 @@ class MelodyAutocompleteEngine:
         Precondition:
             limit is None or limit > 0
         """
-        return self.autocompleter.autocomplete(prefix, limit)
+        if self.cache is None:
+            return self.autocompleter.autocomplete(prefix, limit)
+        return self.cache.fetch(prefix, limit, self.autocompleter.autocomplete)
+
+    def autocomplete_many(self, prefixes: List[List[int]],
+                          limit: Optional[int] = None) \
+            -> List[List[Tuple[Melody, float]]]:
+        """Return the result of self.autocomplete(prefix, limit) for each
+        interval sequence in <prefixes>, in the same order as <prefixes>.
+
+        Precondition:
+            limit is None or limit > 0
+        """
+        return self.autocompleter.autocomplete_many(prefixes, limit)
 
     def remove(self, prefix: List[int]) -> None:
         """Remove all melodies that match the given interval sequence.
         """
-        return self.autocompleter.remove(prefix)
+        self.autocompleter.remove(prefix)
+        if self.cache is not None:
+            self.cache.invalidate_under(prefix)
+
+    def remove_many(self, prefixes: List[List[int]]) -> None:
+        """Remove all melodies that match any of the given interval sequences.
+        """
+        self.autocompleter.remove_many(prefixes)
+        if self.cache is not None:
+            for prefix in prefixes:
+                self.cache.invalidate_under(prefix)
+
+
+################################################################################
+# Asyncio front-end
+################################################################################
+class _ReadWriteLock:
+    """A lock for the coroutines of one event loop, which can be held by any
+    number of readers at once or by a single writer.
+
+    A writer that is waiting keeps new readers from acquiring the lock, so
+    that a steady stream of reads cannot hold off writes forever.
+
+    === Private Attributes ===
+    _readers: The number of readers holding the lock.
+    _writing: Whether a writer holds the lock.
+    _writers_waiting: The number of writers waiting for the lock.
+    _waiters:
+        The futures of the coroutines waiting for the lock, which are all
+        woken to check again whenever the lock is released.
+    """
+    _readers: int
+    _writing: bool
+    _writers_waiting: int
+    _waiters: List[asyncio.Future]
+
+    def __init__(self) -> None:
+        """Initialize an unlocked lock."""
+        self._readers = 0
+        self._writing = False
+        self._writers_waiting = 0
+        self._waiters = []
+
+    async def acquire_read(self) -> None:
+        """Wait until no writer holds or waits for the lock, then hold it as
+        a reader.
+        """
+        while self._writing or self._writers_waiting:
+            await self._wait()
+        self._readers += 1
+
+    def release_read(self) -> None:
+        """Release the lock held as a reader."""
+        self._readers -= 1
+        if not self._readers:
+            self._wake()
+
+    async def acquire_write(self) -> None:
+        """Wait until no one holds the lock, then hold it as the writer."""
+        self._writers_waiting += 1
+        try:
+            while self._writing or self._readers:
+                await self._wait()
+        finally:
+            self._writers_waiting -= 1
+            # Readers held off by this writer may go ahead if it gave up.
+            self._wake()
+        self._writing = True
+
+    def release_write(self) -> None:
+        """Release the lock held as the writer."""
+        self._writing = False
+        self._wake()
+
+    async def _wait(self) -> None:
+        """Wait until the lock is next released."""
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await waiter
+        finally:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+
+    def _wake(self) -> None:
+        """Wake every coroutine waiting for the lock."""
+        waiters, self._waiters = self._waiters, []
+        for waiter in waiters:
+            if not waiter.done():
+                waiter.set_result(None)
+
+
+class AsyncAutocompleteEngine:
+    """An asyncio front-end for a LetterAutocompleteEngine or
+    SentenceAutocompleteEngine.
+
+    The engine's methods run in an executor, so that a slow query does not
+    block the event loop. Queries run alongside each other, while inserts and
+    removes wait for them and run alone. Identical queries that are in flight
+    at the same time share one call to the engine, and a new query from a
+    session supersedes that session's previous one.
+
+    === Attributes ===
+    engine: The engine that answers queries.
+
+    === Private Attributes ===
+    _executor: The executor that the engine's methods run in.
+    _owns_executor: Whether _executor was created by (and is closed with)
+        this front-end.
+    _lock: The lock that queries hold as readers and writes as writers.
+    _in_flight:
+        Maps the sanitized prefix and limit of each query in flight to the
+        task answering it and the number of callers waiting for that task.
+    _sessions:
+        Maps each session with a query in flight to the future its latest
+        caller is waiting for.
+    """
+    engine: Union[LetterAutocompleteEngine, SentenceAutocompleteEngine]
+    _executor: Executor
+    _owns_executor: bool
+    _lock: _ReadWriteLock
+    _in_flight: Dict[Tuple[str, Optional[int]], List]
+    _sessions: Dict[Hashable, asyncio.Future]
+
+    def __init__(self, engine: Union[LetterAutocompleteEngine,
+                                     SentenceAutocompleteEngine],
+                 executor: Optional[Executor] = None) -> None:
+        """Initialize a front-end for <engine> that runs its methods in
+        <executor>, or in a new ThreadPoolExecutor if <executor> is None.
+
+        The engine is shared by the calls it runs, so <executor> must run
+        them in this process (a ProcessPoolExecutor would give every call its
+        own copy of the engine).
+        """
+        self.engine = engine
+        self._owns_executor = executor is None
+        self._executor = ThreadPoolExecutor() if executor is None else executor
+        self._lock = _ReadWriteLock()
+        self._in_flight = {}
+        self._sessions = {}
+
+    async def autocomplete(self, prefix: str, limit: Optional[int] = None,
+                           session: Optional[Hashable] = None) \
+            -> List[Tuple[str, float]]:
+        """Return up to <limit> matches for the given prefix string, as
+        self.engine.autocomplete would.
+
+        If <session> is given, any earlier call with the same session that is
+        still waiting raises asyncio.CancelledError instead of returning. The
+        engine call for a query is cancelled once no caller waits for it, if
+        it has not started yet.
+
+        Precondition: limit is None or limit > 0.
+        """
+        key = (_sanitize(prefix), limit)
+        entry = self._in_flight.get(key)
+        if entry is None:
+            entry = [asyncio.ensure_future(self._read(prefix, limit)), 0]
+            self._in_flight[key] = entry
+            entry[0].add_done_callback(lambda _: self._forget(key, entry))
+        entry[1] += 1
+        waiter = asyncio.shield(entry[0])
+        if session is not None:
+            previous = self._sessions.get(session)
+            if previous is not None:
+                previous.cancel()
+            self._sessions[session] = waiter
+        try:
+            return list(await waiter)
+        finally:
+            entry[1] -= 1
+            if not entry[1] and not entry[0].done():
+                self._forget(key, entry)
+                entry[0].cancel()
+            if session is not None and self._sessions.get(session) is waiter:
+                del self._sessions[session]
+
+    async def insert(self, string: str, weight: float = 1.0) -> None:
+        """Insert <string> with the given weight, as self.engine.insert would,
+        once no other call is using the engine.
+
+        Precondition: weight > 0
+        """
+        await self._write(self.engine.insert, string, weight)
+
+    async def remove(self, prefix: str) -> None:
+        """Remove all strings that match the given prefix, as
+        self.engine.remove would, once no other call is using the engine.
+        """
+        await self._write(self.engine.remove, prefix)
+
+    async def remove_many(self, prefixes: List[str]) -> None:
+        """Remove all strings that match any of the given prefixes, as
+        self.engine.remove_many would, once no other call is using the engine.
+        """
+        await self._write(self.engine.remove_many, prefixes)
+
+    def close(self) -> None:
+        """Shut down the executor, if this front-end created it."""
+        if self._owns_executor:
+            self._executor.shutdown()
+
+    async def _read(self, prefix: str,
+                    limit: Optional[int]) -> List[Tuple[str, float]]:
+        """Return self.engine.autocomplete(prefix, limit), called while
+        holding the lock as a reader.
+        """
+        await self._lock.acquire_read()
+        try:
+            return await self._run(self.engine.autocomplete, prefix, limit)
+        finally:
+            self._lock.release_read()
+
+    async def _write(self, method: Callable, *args: Any) -> None:
+        """Call method(*args) while holding the lock as the writer."""
+        await self._lock.acquire_write()
+        try:
+            await self._run(method, *args)
+        finally:
+            self._lock.release_write()
+
+    async def _run(self, method: Callable, *args: Any) -> Any:
+        """Return method(*args), called in self._executor.
+
+        If this is cancelled after the call has started, it still waits for
+        the call to finish before raising asyncio.CancelledError, so that the
+        caller's lock is held for as long as the call uses the engine.
+        """
+        future = self._executor.submit(method, *args)
+        try:
+            return await asyncio.wrap_future(future)
+        except asyncio.CancelledError:
+            await self._finish(future)
+            raise
+
+    @staticmethod
+    async def _finish(future: Future) -> None:
+        """Wait for <future> to be done, even if this is cancelled meanwhile.
+        """
+        waiting = asyncio.wrap_future(future)
+        while not waiting.done():
+            try:
+                await asyncio.wait([waiting])
+            except asyncio.CancelledError:
+                pass
+
+    def _forget(self, key: Tuple[str, Optional[int]], entry: List) -> None:
+        """Stop sharing the task in <entry> with new queries for <key>."""
+        if self._in_flight.get(key) is entry:
+            del self._in_flight[key]
 
 
 ###############################################################################
@@ -354,11 +1144,6 @@ if __name__ == '__main__':
     #     'allowed-io': ['__init__'],
     #     'extra-imports': ['csv', 'prefix_tree', 'melody']
     # })
-    #
-    # This is used to increase the recursion limit so that your sample runs
-    # work even for fairly tall simple prefix trees.
-    import sys
-    sys.setrecursionlimit(5000)
 
     print(sample_letter_autocomplete())
     print(sample_sentence_autocomplete())
@@ -0,0 +1,234 @@
+"""CSC148 Assignment 2: Benchmarks
+
+=== Module Description ===
+This file contains benchmarks for the prefix trees in prefix_tree.py and the
+engines in autocomplete_engines.py. Each benchmark loads one of the data files
+used by the sample runs and prints what it measured.
+"""
+from __future__ import annotations
+import sys
+import time
+from typing import Any, Dict, List, Tuple
+
+from autocomplete_engines import LetterAutocompleteEngine, _letter_items, \
+    _sanitize, _sanitize_line, _sanitize_lines
+from prefix_tree import AGGREGATORS, CompressedPrefixTree, SimplePrefixTree
+
+
+################################################################################
+# Memory
+################################################################################
+class _DictTree:
+    """A prefix tree node laid out like the original tree classes: a plain
+    object whose attributes live in a per-instance __dict__, and whose value
+    is a list holding its full prefix if it is not a leaf.
+    """
+    value: Any
+    weight: float
+    subtrees: List[_DictTree]
+    weight_type: str
+    length: int
+
+    def __init__(self, tree: SimplePrefixTree) -> None:
+        """Initialize a copy of the root of <tree>, without its subtrees."""
+        self.value = tree.value
+        self.weight = tree.weight
+        self.subtrees = []
+        self.weight_type = tree.weight_type
+        self.length = tree.length
+
+
+def _layout_sizes(tree: SimplePrefixTree) -> Tuple[int, int, int]:
+    """Return the number of trees in <tree>, and the bytes they take up in the
+    current layout and in the original layout.
+
+    The values stored in leaves are the same in both layouts and are not
+    counted. A prefix sequence shared by several trees is counted once.
+    """
+    count = current = original = 0
+    sources = set()
+    stack = [tree]
+    while stack:
+        tree = stack.pop()
+        stack.extend(tree.subtrees)
+        count += 1
+        current += sys.getsizeof(tree) + sys.getsizeof(tree.subtrees)
+        for private in [tree._children, tree._top]:
+            if private is not None:
+                current += sys.getsizeof(private)
+        copy = _DictTree(tree)
+        original += sys.getsizeof(copy) + sys.getsizeof(copy.__dict__) + \
+            sys.getsizeof(tree.subtrees)
+        if isinstance(copy.value, list):
+            original += sys.getsizeof(copy.value)
+            if id(tree._value) not in sources:
+                sources.add(id(tree._value))
+                current += sys.getsizeof(tree._value)
+    return count, current, original
+
+
+def memory_benchmark(file: str = 'data/lotr.txt',
+                     autocompleter: str = 'simple') -> Dict[str, float]:
+    """Load <file> into a LetterAutocompleteEngine and compare the memory used
+    by its prefix tree with that of the same tree in the original layout.
+
+    Return a dictionary with the number of trees and the bytes per tree for
+    each layout.
+    """
+    engine = LetterAutocompleteEngine({
+        'file': file,
+        'autocompleter': autocompleter,
+        'weight_type': 'sum'
+    })
+    trees, current, original = _layout_sizes(engine.autocompleter)
+    return {
+        'trees': trees,
+        'bytes_per_tree': current / trees,
+        'original_bytes_per_tree': original / trees
+    }
+
+
+################################################################################
+# Sanitization
+################################################################################
+def _sanitize_per_char(text: str) -> str:
+    """Sanitize <text>, a line of a file, one character at a time, as
+    LetterAutocompleteEngine used to: the alphanumeric characters and spaces
+    are kept, and then put in lowercase.
+    """
+    return ''.join(c for c in text if c.isalnum() or c == ' ').lower()
+
+
+def _sanitize_query_per_char(text: str) -> str:
+    """Sanitize <text>, a query, one character at a time, as the engines
+    used to: it is put in lowercase, and then the alphanumeric characters and
+    spaces are kept.
+    """
+    return ''.join(c for c in text.lower() if c.isalnum() or c == ' ')
+
+
+def sanitize_benchmark(file: str = 'data/lotr.txt',
+                       copies: int = 20) -> Dict[str, float]:
+    """Check that the engines' sanitizers agree with the per-character ones
+    on every character, for lines of a file and for queries, and on every
+    line of <file>, then time the per-character and chunked sanitizers of
+    lines on <copies> copies of the lines of <file>.
+
+    Return a dictionary with the number of seconds each sanitizer took.
+    """
+    for code in range(sys.maxunicode + 1):
+        assert _sanitize_line(chr(code)) == _sanitize_per_char(chr(code)), \
+            code
+        assert _sanitize(chr(code)) == _sanitize_query_per_char(chr(code)), \
+            code
+    with open(file, encoding='utf8') as f:
+        lines = f.readlines() * copies
+
+    start = time.perf_counter()
+    expected = [_sanitize_per_char(line) for line in lines]
+    per_char = time.perf_counter() - start
+    start = time.perf_counter()
+    actual = list(_sanitize_lines(lines))
+    chunked = time.perf_counter() - start
+    assert actual == expected
+    return {'lines': len(lines), 'per_char_seconds': per_char,
+            'chunked_seconds': chunked}
+
+
+################################################################################
+# Insertion
+################################################################################
+def insert_benchmark(file: str = 'data/lotr.txt',
+                     autocompleter: str = 'compressed') -> Dict[str, float]:
+    """Insert the strings that a LetterAutocompleteEngine reads from <file>
+    into an empty prefix tree one at a time, with Autocompleter.insert.
+
+    Return a dictionary with the number of inserts and the number of inserts
+    per second.
+    """
+    with open(file, encoding='utf8') as f:
+        items = list(_letter_items(f))
+    if autocompleter == 'simple':
+        tree = SimplePrefixTree('sum')
+    else:
+        tree = CompressedPrefixTree('sum')
+    start = time.perf_counter()
+    for value, weight, prefix in items:
+        tree.insert(value, weight, prefix)
+    seconds = time.perf_counter() - start
+    return {'inserts': len(items), 'inserts_per_second': len(items) / seconds}
+
+
+def reinsert_benchmark(file: str = 'data/lotr.txt',
+                       autocompleter: str = 'compressed') -> Dict[str, float]:
+    """Load the strings that a LetterAutocompleteEngine reads from <file>
+    into a prefix tree, then insert every one of them again, first without
+    and then with a value index.
+
+    Return a dictionary with the number of inserts and the number of seconds
+    they took each way.
+    """
+    with open(file, encoding='utf8') as f:
+        items = list(_letter_items(f))
+    if autocompleter == 'simple':
+        tree = SimplePrefixTree.from_items('sum', items)
+    else:
+        tree = CompressedPrefixTree.from_items('sum', items)
+    stats = {'inserts': len(items)}
+    for name in ['scan_seconds', 'index_seconds']:
+        if name == 'index_seconds':
+            tree.index_values()
+        start = time.perf_counter()
+        for value, weight, prefix in items:
+            tree.insert(value, weight, prefix)
+        stats[name] = time.perf_counter() - start
+    return stats
+
+
+################################################################################
+# Aggregate weights
+################################################################################
+def weight_type_benchmark(file: str = 'data/lotr.txt', limit: int = 10) \
+        -> Dict[str, float]:
+    """Load the strings that a LetterAutocompleteEngine reads from <file>
+    into a compressed prefix tree of each weight type, then autocomplete the
+    first two characters of every string with <limit>.
+
+    Return a dictionary with the number of seconds the queries took for each
+    weight type.
+    """
+    with open(file, encoding='utf8') as f:
+        items = list(_letter_items(f))
+    queries = [prefix[:2] for _, _, prefix in items]
+    stats = {}
+    for weight_type in AGGREGATORS:
+        tree = CompressedPrefixTree.from_items(weight_type, items)
+        start = time.perf_counter()
+        for prefix in queries:
+            tree.autocomplete(prefix, limit)
+        stats[weight_type] = time.perf_counter() - start
+    return stats
+
+
+if __name__ == '__main__':
+    for kind in ['simple', 'compressed']:
+        stats = memory_benchmark(autocompleter=kind)
+        print(f'{kind}: {stats["trees"]} trees, '
+              f'{stats["bytes_per_tree"]:.0f} bytes per tree '
+              f'(original layout: {stats["original_bytes_per_tree"]:.0f})')
+    stats = sanitize_benchmark()
+    print(f'sanitizing {stats["lines"]} lines: '
+          f'{stats["per_char_seconds"]:.3f}s per character, '
+          f'{stats["chunked_seconds"]:.3f}s in chunks')
+    for data in ['data/lotr.txt', 'data/google_no_swears.txt']:
+        stats = insert_benchmark(data)
+        print(f'compressed inserts from {data}: {stats["inserts"]} inserts, '
+              f'{stats["inserts_per_second"]:.0f} per second')
+    stats = reinsert_benchmark()
+    print(f'inserting {stats["inserts"]} values again: '
+          f'{stats["scan_seconds"]:.3f}s by scanning leaves, '
+          f'{stats["index_seconds"]:.3f}s with a value index')
+    stats = weight_type_benchmark()
+    print('autocompleting with a limit: ' +
+          ', '.join(f'{seconds:.3f}s with {weight_type} weights'
+                    for weight_type, seconds in stats.items()))
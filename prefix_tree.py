@@ -15,7 +15,36 @@ testing directly! You may, however, add new private attributes, methods, and
 top-level functions to this file.
 """
 from __future__ import annotations
-from typing import Any, List, Optional, Tuple
+import gc
+import heapq
+import itertools
+import math
+import mmap
+import operator
+import pickle
+import struct
+import sys
+import threading
+import time
+import zlib
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, \
+    Sequence, Tuple
+
+# Trees with at most this many subtrees find a subtree by scanning them;
+# larger trees keep a dict index of their non-leaf subtrees.
+INDEX_THRESHOLD = 8
+
+# The layout of a snapshot file written by SimplePrefixTree.save; see
+# MappedPrefixTree for what each part holds.
+SNAPSHOT_MAGIC = b'PTSNAP01'
+_HEADER = struct.Struct('<8sIQQQQQ')
+_NODE = struct.Struct('<dIIIIIII')
+_U32 = struct.Struct('<I')
+_U64 = struct.Struct('<Q')
+
+# A DecayingAutocompleter moves to a new epoch once the weights it stores
+# would grow by more than this factor, i.e. after 32 half-lives.
+DECAY_RESCALE_FACTOR = 2.0 ** 32
 
 
 ################################################################################
@@ -24,6 +53,8 @@ from typing import Any, List, Optional, Tuple
 class Autocompleter:
     """An abstract class representing the Autocompleter Abstract Data Type.
     """
+    __slots__ = ()
+
     def __len__(self) -> int:
         """Return the number of values stored in this Autocompleter."""
         raise NotImplementedError
@@ -59,17 +90,154 @@ class Autocompleter:
         """
         raise NotImplementedError
 
+    def autocomplete_many(self, prefixes: List[List],
+                          limit: Optional[int] = None) \
+            -> List[List[Tuple[Any, float]]]:
+        """Return the result of self.autocomplete(prefix, limit) for each
+        prefix in <prefixes>, in the same order as <prefixes>.
+
+        Precondition: limit is None or limit > 0.
+        """
+        return [self.autocomplete(prefix, limit) for prefix in prefixes]
+
+    def cursor(self) -> PrefixCursor:
+        """Return a new PrefixCursor over self, at the empty prefix."""
+        return PrefixCursor(self)
+
     def remove(self, prefix: List) -> None:
         """Remove all values that match the given prefix.
         """
         raise NotImplementedError
 
+    def remove_many(self, prefixes: List[List]) -> None:
+        """Remove all values that match any of the given prefixes."""
+        for prefix in prefixes:
+            self.remove(prefix)
+
+
+class PrefixCursor:
+    """A prefix that is extended or shortened one element at a time, as when
+    a user types a query, together with the Autocompleter it completes in.
+
+    This version searches the Autocompleter again for every autocomplete;
+    subclasses remember where earlier searches stopped.
+
+    === Attributes ===
+    autocompleter: The Autocompleter this cursor completes prefixes in.
+    prefix: The current prefix.
+    """
+    autocompleter: Autocompleter
+    prefix: List
+
+    __slots__ = ('autocompleter', 'prefix')
+
+    def __init__(self, autocompleter: Autocompleter) -> None:
+        """Initialize a cursor over <autocompleter>, at the empty prefix."""
+        self.autocompleter = autocompleter
+        self.prefix = []
+
+    def advance(self, element: Any) -> None:
+        """Extend the current prefix by <element>."""
+        self.prefix.append(element)
+
+    def retreat(self) -> None:
+        """Remove the last element of the current prefix.
+
+        Precondition: self.prefix != []
+        """
+        self.prefix.pop()
+
+    def autocomplete(self, limit: Optional[int] = None) \
+            -> List[Tuple[Any, float]]:
+        """Return up to <limit> matches for the current prefix, as
+        self.autocompleter.autocomplete(self.prefix, limit) would.
+
+        Precondition: limit is None or limit > 0.
+        """
+        return self.autocompleter.autocomplete(self.prefix, limit)
+
+
+################################################################################
+# Aggregators
+################################################################################
+class Aggregator:
+    """A way of combining the weights of the leaves in a prefix tree into
+    the aggregate weight of the tree.
+
+    Every non-leaf tree keeps the number, the total weight and the heaviest
+    weight of its leaves, and its subtrees sorted by weight, so an aggregator
+    derives the aggregate weight from those instead of updating it on every
+    change. A tree whose only leaf has weight w must have aggregate weight w.
+
+    === Attributes ===
+    bounds_leaves:
+        Whether the aggregate weight of a tree is at least the weight of
+        every leaf in it, so that a best-first search for the heaviest leaves
+        only needs to look at the next sibling of a subtree once it has
+        looked at the subtree itself.
+    """
+    bounds_leaves: bool = False
+
+    __slots__ = ()
+
+    def aggregate(self, tree: SimplePrefixNode) -> float:
+        """Return the aggregate weight of <tree>, a non-empty non-leaf tree
+        whose length, total and subtree order are up to date.
+        """
+        raise NotImplementedError
+
+
+class SumAggregator(Aggregator):
+    """The aggregate weight of a tree is the total weight of its leaves."""
+    bounds_leaves = True
+
+    __slots__ = ()
+
+    def aggregate(self, tree: SimplePrefixNode) -> float:
+        """Return the aggregate weight of <tree>."""
+        return float(tree._total)
+
+
+class AverageAggregator(Aggregator):
+    """The aggregate weight of a tree is the average weight of its leaves.
+    """
+    __slots__ = ()
+
+    def aggregate(self, tree: SimplePrefixNode) -> float:
+        """Return the aggregate weight of <tree>."""
+        return tree._total / tree.length
+
+
+class MaxAggregator(Aggregator):
+    """The aggregate weight of a tree is the weight of its heaviest leaf."""
+    bounds_leaves = True
+
+    __slots__ = ()
+
+    def aggregate(self, tree: SimplePrefixNode) -> float:
+        """Return the aggregate weight of <tree>."""
+        return tree._max
+
+
+# The aggregator for each weight type. A weight type is added by adding its
+# aggregator here.
+AGGREGATORS: Dict[str, Aggregator] = {
+    'sum': SumAggregator(),
+    'average': AverageAggregator(),
+    'max': MaxAggregator()
+}
+
 
 ################################################################################
 # SimplePrefixTree (Tasks 1-3)
 ################################################################################
-class SimplePrefixTree(Autocompleter):
-    """A simple prefix tree.
+class SimplePrefixNode:
+    """A tree in a simple prefix tree: either the root, which is a
+    SimplePrefixTree, or one of the trees below it.
+
+    Any tree can be searched with autocomplete. The operations that change a
+    whole tree, such as insert and remove, keep state that only the root
+    has, so they are methods of SimplePrefixTree alone.
 
     This class follows the implementation described on the assignment handout.
     Note that we've made the attributes public because we will be accessing them
@@ -89,6 +257,31 @@ class SimplePrefixTree(Autocompleter):
     weight_type: A str records what kind of aggregate weight it is.
     length: A int that records how many leaves are in the tree.
 
+    === Private Attributes ===
+    _value:
+        If this tree is a leaf, the value stored in it. Otherwise a prefix
+        sequence, usually shared with other trees, that starts with
+        self.value.
+    _depth:
+        The length of self.value if this tree is not a leaf, so that
+        self.value == list(self._value[:self._depth]); None for a leaf.
+    _children:
+        An index of the non-leaf subtrees of this prefix tree, keyed on the
+        prefix element that follows self.value in the subtree's value, or None
+        while this tree has few enough subtrees to scan them instead.
+    _top_k:
+        The number of heaviest leaves cached at each non-leaf tree, or None if
+        no results are cached.
+    _top:
+        The (up to) _top_k heaviest leaves in this tree, in non-increasing
+        order of weight, or None if _top_k is None.
+    _total:
+        The total weight of the leaves in this tree, from which the aggregator
+        for self.weight_type derives self.weight. Not used by leaves.
+    _max:
+        The weight of the heaviest leaf in this tree, which bounds the weight
+        of every leaf below it whatever the weight type. Not used by leaves.
+
     === Representation invariants ===
     - self.weight >= 0
 
@@ -102,6 +295,10 @@ class SimplePrefixTree(Autocompleter):
         If len(self.subtrees) > 0, then self.value is a list (*common prefix*),
         and self.weight > 0 (*aggregate weight*).
 
+    - If self._children is not None, it contains exactly the non-leaf trees
+      in self.subtrees, and self._children[subtree.value[len(self.value)]]
+      is subtree. It is not None if len(self.subtrees) > INDEX_THRESHOLD.
+
     - ("prefixes grow by 1")
       If len(self.subtrees) > 0, and subtree in self.subtrees, and subtree
       is non-empty and not a leaf, then
@@ -117,24 +314,76 @@ class SimplePrefixTree(Autocompleter):
     """
     value: Any
     weight: float
-    subtrees: List[SimplePrefixTree]
+    subtrees: List[SimplePrefixNode]
     weight_type: str
     length: int
-
-    def __init__(self, weight_type: str) -> None:
+    _value: Any
+    _depth: Optional[int]
+    _children: Optional[Dict[Any, SimplePrefixNode]]
+    _top_k: Optional[int]
+    _top: Optional[List[SimplePrefixNode]]
+    _total: float
+    _max: float
+
+    # A tree is created for every prefix and every value, so its attributes
+    # are kept in slots rather than a per-instance __dict__.
+    __slots__ = ('weight', 'subtrees', 'weight_type', 'length', '_value',
+                 '_depth', '_children', '_top_k', '_top', '_total', '_max')
+
+    def __init__(self, weight_type: str, top_k: Optional[int] = None) -> None:
         """Initialize an empty simple prefix tree.
 
-        Precondition: weight_type == 'sum' or weight_type == 'average'.
+        Precondition: weight_type is a key of AGGREGATORS, such as 'sum',
+                      'average' or 'max'.
+                      top_k is None or top_k > 0.
 
         The given <weight_type> value specifies how the aggregate weight
         of non-leaf trees should be calculated (see the assignment handout
-        for details).
+        for details, and AGGREGATORS for 'max').
+
+        If <top_k> is given, every non-leaf tree keeps its <top_k> heaviest
+        leaves up to date, so that autocomplete with a limit of at most
+        <top_k> is answered without searching the matching subtree.
         """
-        self.value = []
+        self.assign_prefix([], 0)
         self.weight = 0.0
         self.subtrees = []
         self.weight_type = weight_type
         self.length = 0
+        self._children = None
+        self._top_k = top_k
+        self._top = None if top_k is None else []
+        self._total = 0.0
+        self._max = 0.0
+
+    @property
+    def value(self) -> Any:
+        """The value stored at the root of this prefix tree.
+
+        The common prefix of a non-leaf tree is rebuilt from the shared
+        sequence it points into, so that trees on the same path do not each
+        hold a full copy of their prefix.
+        """
+        if self._depth is None:
+            return self._value
+        return list(self._value[:self._depth])
+
+    @value.setter
+    def value(self, value: Any) -> None:
+        """Store <value> in this tree. As with the rest of this module, a list
+        is taken to be the common prefix of a non-leaf tree. A leaf is given
+        its value by assign instead, which stores a list value as it is.
+        """
+        if isinstance(value, list):
+            self.assign_prefix(value, len(value))
+        else:
+            self._value = value
+            self._depth = None
+
+    def assign_prefix(self, source: Sequence, depth: int) -> None:
+        """Make self.value the prefix source[:depth] without copying it."""
+        self._value = source
+        self._depth = depth
 
     def is_empty(self) -> bool:
         """Return whether this simple prefix tree is empty."""
@@ -158,163 +407,304 @@ class SimplePrefixTree(Autocompleter):
         """
         if self.is_empty():
             return ''
-        else:
-            s = '  ' * depth + f'{self.value} ({self.weight})\n'
-            for subtree in self.subtrees:
-                s += subtree._str_indented(depth + 1)
-            return s
+        lines = []
+        stack = [(self, depth)]
+        while stack:
+            tree, tree_depth = stack.pop()
+            lines.append('  ' * tree_depth + f'{tree.value} ({tree.weight})\n')
+            for subtree in reversed(tree.subtrees):
+                stack.append((subtree, tree_depth + 1))
+        return ''.join(lines)
 
     def __len__(self) -> int:
         """Return the number of values stored in this Autocompleter."""
-        # Does it mean to count leaves?
-        if self.is_empty():
-            return 0
-        elif self.is_leaf():
+        # A non-leaf tree keeps the number of leaves below it in self.length,
+        # which every operation keeps up to date.
+        if self.is_leaf():
             return 1
+        return self.length
+
+    def adjust_weight(self, weight: float, leaf_weight: float) -> None:
+        """Add <weight> to the total weight of the leaves in self, where a
+        leaf in self has just been inserted or gained weight and now weighs
+        <leaf_weight>, and recompute the aggregate weight of self.
+
+        Precondition: self.length and the order of self.subtrees are up to
+        date.
+        """
+        self._total = self._total + weight
+        if leaf_weight > self._max:
+            self._max = leaf_weight
+        self.refresh_weight()
+
+    def lose_weight(self, weight: float, leaf_weight: float) -> None:
+        """Subtract <weight> from the total weight of the leaves in self,
+        where leaves in self weighing at most <leaf_weight> have just been
+        removed or lost weight, and recompute the aggregate weight of self.
+
+        The heaviest leaf of self is only looked for again if it may have
+        been one of them. Subtracting leaves behind the rounding error of
+        what was subtracted, so if that leaves the total below the heaviest
+        leaf, the total is summed again from the subtrees of self.
+
+        Precondition: self.length and the order of self.subtrees are up to
+        date.
+        """
+        if leaf_weight >= self._max:
+            self.refresh_max()
+        self._total = self._total - weight
+        if self._total < self._max:
+            self._total = sum(subtree.leaf_total()
+                              for subtree in self.subtrees)
+        self.refresh_weight()
+
+    def refresh_max(self) -> None:
+        """Recompute the weight of the heaviest leaf in self from its
+        subtrees.
+
+        When the weight of a subtree bounds the weight of every leaf in it,
+        the search stops at the first subtree too light to hold a heavier
+        leaf than the heaviest one found so far.
+
+        Precondition: self.subtrees is sorted.
+        """
+        bounds_leaves = AGGREGATORS[self.weight_type].bounds_leaves
+        heaviest = 0.0
+        for subtree in self.subtrees:
+            if bounds_leaves and subtree.weight <= heaviest:
+                break
+            heaviest = max(heaviest, subtree.leaf_max())
+        self._max = heaviest
+
+    def refresh_weight(self) -> None:
+        """Recompute the aggregate weight of self from its length, total,
+        heaviest leaf and subtrees.
+
+        Precondition: self is not a leaf, and its subtrees are sorted.
+        """
+        if self.length == 0:
+            self.weight = 0.0
+            self._total = 0.0
+            self._max = 0.0
         else:
-            length = 0
-            for subtree in self.subtrees:
-                length += len(subtree)
-            return length
-
-    def update_weight(self, weight: float, change: int) -> None:
-        """Change the weight after insertion."""
-        if self.weight_type == 'average':
-            self.weight = \
-                (self.weight * (self.length - change) + weight) / self.length
-        else:
-            self.weight = self.weight + weight
+            self.weight = AGGREGATORS[self.weight_type].aggregate(self)
+
+    def leaf_total(self) -> float:
+        """Return the total weight of the leaves in self."""
+        if self.is_leaf():
+            return self.weight
+        return self._total
+
+    def leaf_max(self) -> float:
+        """Return the weight of the heaviest leaf in self."""
+        if self.is_leaf():
+            return self.weight
+        return self._max
 
     def isprefix(self, prefix: list) -> bool:
         """This function judges whether a tree is a 'prefix' of a list. If the
         value of the tree is the 'prefix' of a list, will return True. Otherwise
         will return False.
         """
-        if not isinstance(self.value, list):
+        if self._depth is None:
             return False
-        elif len(self.value) > len(prefix):
+        elif self._depth > len(prefix):
             return False
         else:
             return all(
-                [self.value[i] == prefix[i] for i in range(len(self.value))])
+                [self._value[i] == prefix[i] for i in range(self._depth)])
 
-    def insert(self, value: Any, weight: float, prefix: List) -> None:
-        """Insert the given value into this Autocompleter.
+    def path_to(self, prefix: Sequence) -> List[SimplePrefixNode]:
+        """Return the trees from self down to the tree whose value is
+        <prefix>.
 
-        The value is inserted with the given weight, and is associated with
-        the prefix sequence <prefix>.
+        Precondition: a value with <prefix> is stored in this tree.
+        """
+        path = [self]
+        subtree = self.next_subtree(prefix)
+        while subtree is not None:
+            path.append(subtree)
+            subtree = subtree.next_subtree(prefix)
+        return path
 
-        If the value has already been inserted into this prefix tree
-        (compare values using ==), then the given weight should be *added* to
-        the existing weight of this value.
+    def remove_helper(self) -> None:
+        """Do nothing, as a simple prefix tree is never compressed."""
+        return
 
-        Preconditions:
-            weight > 0
-            The given value is either:
-                1) not in this Autocompleter
-                2) was previously inserted with the SAME prefix sequence
+    def scale_weights(self, factor: float) -> None:
+        """Multiply the weight of every value in this tree by <factor>, and
+        recompute every aggregate weight.
+
+        A weight is kept at least sys.float_info.min, so that no leaf is
+        left with a weight of 0.
+
+        Precondition: factor >= 0.
+        """
+        # Each tree is listed before its subtrees, so it is finished after
+        # them.
+        trees = []
+        stack = [self]
+        while stack:
+            tree = stack.pop()
+            if tree._depth is None:
+                tree.weight = max(tree.weight * factor, sys.float_info.min)
+            elif tree.subtrees:
+                trees.append(tree)
+                stack.extend(tree.subtrees)
+        for tree in reversed(trees):
+            tree._total = sum(subtree.leaf_total()
+                              for subtree in tree.subtrees)
+            tree.finish_built()
+
+    def agrees_with(self, prefix: List, start: int) -> bool:
+        """Return whether self.value and <prefix> have the same items from
+        index <start> to the end of the shorter one.
+        """
+        return self.common_length(prefix, start) == \
+            min(len(prefix), self._depth)
+
+    def common_length(self, prefix: List, start: int) -> int:
+        """Return the length of the longest common prefix of self.value and
+        <prefix>, which have the same items before index <start>.
+        """
+        end = min(len(prefix), self._depth)
+        i = start
+        while i < end and self._value[i] == prefix[i]:
+            i += 1
+        return i
+
+    def next_subtree(self, prefix: List) -> Optional[SimplePrefixNode]:
+        """Return the subtree of self that <prefix> continues into, or None if
+        the tree ends here.
+
+        Precondition: self.value is a prefix of <prefix>.
+        """
+        if self._depth < len(prefix):
+            return self.find_subtree(prefix[self._depth])
+        return None
+
+    def insert_here(self, value: Any, weight: float, prefix: List,
+                    new: bool = False) -> SimplePrefixNode:
+        """Insert <value> with <weight> and <prefix> into self, where <prefix>
+        does not continue into any subtree of self, and return the leaf of
+        <value>. If <new> is True, <value> is known not to be in self, so the
+        leaves of self are not searched for it.
+
+        Unlike insert, this does not update the trees above self.
         """
         if self.is_empty():
-            last_new_prefix = self.add_new_common_prefix(
-                prefix[len(self.value):], weight)
-            new_leaf = SimplePrefixTree(self.weight_type)
+            last_new_prefix = self.add_new_common_prefix(prefix, weight)
+            new_leaf = SimplePrefixNode(self.weight_type)
             new_leaf.assign(value, weight)
             last_new_prefix.subtrees.append(new_leaf)
+            last_new_prefix.index_subtree(new_leaf)
             last_new_prefix.length = last_new_prefix.length + 1
-            self.weight = float(weight)
-            return
-        elif self.value == prefix:
-            # That means the prefix is in the tree.
-            for subtree in self.subtrees:
+            self.adjust_weight(weight, new_leaf.weight)
+            self.merge_top_along(prefix, new_leaf)
+            return new_leaf
+        elif self._depth == len(prefix):
+            # self.value is a prefix of prefix (we only ever descend along
+            # prefix), so that means the prefix is in the tree.
+            for subtree in [] if new else self.subtrees:
                 if subtree.value == value:
                     # That means the value is in the tree. So the length does
                     # not need to be updated.
+                    old_subtree_weight = subtree.weight
                     subtree.weight = float(subtree.weight + weight)
-                    self.update_weight(weight, 0)
-                    self.subtrees = sorted(self.subtrees,
-                                           key=lambda x: x.weight, reverse=True)
-                    return
+                    self.move_subtree(subtree, old_subtree_weight)
+                    self.adjust_weight(weight, subtree.weight)
+                    self.merge_top(subtree)
+                    return subtree
             # the value is not in the tree although the prefix is in.
             # Length needs to be updated.
-            new_leaf = SimplePrefixTree(self.weight_type)
+            new_leaf = SimplePrefixNode(self.weight_type)
             new_leaf.assign(value, weight)
-            self.subtrees.append(new_leaf)
+            self.add_subtree(new_leaf)
+            self.index_subtree(new_leaf)
             self.length = self.length + 1
-            self.update_weight(weight, 1)
-            self.subtrees = sorted(self.subtrees,
-                                   key=lambda x: x.weight, reverse=True)
-            return
+            self.adjust_weight(weight, new_leaf.weight)
+            self.merge_top(new_leaf)
+            return new_leaf
         else:
-            # self.value is not the prefix, not sure whether prefix is in
-            # or not. May need recursive call.
-            for subtree in self.subtrees:
-                if subtree.isprefix(prefix):
-                    old_subtree_length = subtree.length
-                    subtree.insert(value, weight, prefix)
-                    self.length = self.length + (subtree.length -
-                                                 old_subtree_length)
-                    self.update_weight(weight,
-                                       (subtree.length - old_subtree_length))
-                    self.subtrees = sorted(self.subtrees,
-                                           key=lambda x: x.weight,
-                                           reverse=True)
-                    self.subtrees = sorted(self.subtrees,
-                                           key=lambda x: x.weight, reverse=True)
-                    return
-            last_new_prefix = self.add_new_common_prefix(
-                prefix[len(self.value):], weight)
-            new_leaf = SimplePrefixTree(self.weight_type)
+            # prefix goes on past self.value, but no subtree follows it.
+            last_new_prefix = self.add_new_common_prefix(prefix, weight)
+            new_leaf = SimplePrefixNode(self.weight_type)
             new_leaf.assign(value, weight)
             last_new_prefix.subtrees.append(new_leaf)
+            last_new_prefix.index_subtree(new_leaf)
             last_new_prefix.length = last_new_prefix.length + 1
-            self.update_weight(weight, 1)
-            self.subtrees = sorted(self.subtrees,
-                                   key=lambda x: x.weight, reverse=True)
-            return
+            self.adjust_weight(weight, new_leaf.weight)
+            self.merge_top_along(prefix, new_leaf)
+            return new_leaf
 
     def add_new_common_prefix(self, prefix: List, weight: float) \
-            -> SimplePrefixTree:
-        """Add new_common_prefix below an internal value and return the new
-        common prefix.
+            -> SimplePrefixNode:
+        """Add new_common_prefix below an internal value for each element of
+        <prefix> after self.value, and return the last new common prefix.
+
+        The new common prefixes all point into a single copy of <prefix>.
         """
-        if not prefix:
-            return self
-        else:
-            new_common_prefix = SimplePrefixTree(self.weight_type)
-            new_common_prefix.value = self.value + [prefix[0]]
+        source = tuple(prefix)
+        last_new_prefix = self
+        while last_new_prefix._depth < len(prefix):
+            new_common_prefix = SimplePrefixNode(self.weight_type,
+                                                 self._top_k)
+            new_common_prefix.assign_prefix(source,
+                                            last_new_prefix._depth + 1)
             new_common_prefix.weight = float(weight)
-            self.subtrees.append(new_common_prefix)
-            self.length = self.length + 1
-            return new_common_prefix.add_new_common_prefix(prefix[1:], weight)
+            new_common_prefix._total = float(weight)
+            new_common_prefix._max = float(weight)
+            last_new_prefix.add_subtree(new_common_prefix)
+            last_new_prefix.index_subtree(new_common_prefix)
+            last_new_prefix.length = last_new_prefix.length + 1
+            last_new_prefix = new_common_prefix
+        return last_new_prefix
+
+    def add_built_subtree(self, subtree: SimplePrefixNode,
+                          compress: bool) -> None:
+        """Finish <subtree> and add it to self.subtrees, while both are being
+        built by build.
+        """
+        subtree.finish_built()
+        if compress and len(subtree.subtrees) == 1 and \
+                not subtree.subtrees[0].is_leaf():
+            subtree = subtree.subtrees[0]
+        self.subtrees.append(subtree)
+        self.length = self.length + subtree.length
+        self._total = self._total + subtree._total
+
+    def finish_built(self) -> None:
+        """Sort the subtrees of self and derive its aggregate weight from its
+        length and total.
+        """
+        if len(self.subtrees) > 1:
+            self.subtrees = sorted(self.subtrees, key=lambda x: x.weight,
+                                   reverse=True)
+        self.refresh_max()
+        self.refresh_weight()
+        self.index_subtrees()
+        self.refresh_top()
 
-    def search_prefix(self, prefix: List) -> tuple:
+    def search_prefix(self, prefix: List, start: int = 0) -> tuple:
         """Find which internal value we should end at.
         There are two possible cases:
         1. Stop when we find prefix == self.value, in other words, the prefix
          exists in the tree already.
         2. Stop when we find prefix doesn't contain all items in any
         subtree.value).
-        This function maybe called recursively, if we find one subtree.value
-        whose items are all in prefix.
+        The search moves down one subtree at a time, as long as it finds a
+        subtree.value whose items are all in prefix.
+
+        Precondition: self.value is a prefix of <prefix>. (<start> is only
+        used by CompressedPrefixTree.)
         """
-        if self.value == prefix:
-            return self, True
-        else:
-            keep_search = False
-            i = 0
-            for i in range(len(self.subtrees)):
-                if isinstance(self.subtrees[i].value, list):
-                    # Will len(self.subtrees[i].value > len(prefix))
-                    # and it causes a problem?
-                    if all([self.subtrees[i].value[k] == prefix[k] for k in
-                            range(len(self.subtrees[i].value))]) \
-                            and not self.subtrees[i].is_leaf():
-                        keep_search = True
-                        break
-            if keep_search:
-                return self.subtrees[i].search_prefix(prefix)
-            else:
-                return self, False
+        tree = self
+        while tree._depth < len(prefix):
+            subtree = tree.find_subtree(prefix[tree._depth])
+            if subtree is None:
+                return tree, False
+            tree = subtree
+        return tree, tree._depth == len(prefix)
 
     def autocomplete(self, prefix: List,
                      limit: Optional[int] = None) -> List[Tuple[Any, float]]:
@@ -330,159 +720,458 @@ class SimplePrefixTree(Autocompleter):
         stop_point, prefix_is_in = self.search_prefix(prefix)
         if prefix_is_in is False:
             return []
-        else:
-            accumulator = stop_point.autocomplete_helper(limit)
-        return accumulator
+        return stop_point.autocomplete_here(limit)
+
+    def autocomplete_many(self, prefixes: List[List],
+                          limit: Optional[int] = None) \
+            -> List[List[Tuple[Any, float]]]:
+        """Return the result of self.autocomplete(prefix, limit) for each
+        prefix in <prefixes>, in the same order as <prefixes>.
+
+        The prefixes are answered in sorted order, so that a prefix that
+        extends an earlier one resumes the search from where that one stopped
+        instead of from the root.
+
+        Preconditions:
+            limit is None or limit > 0
+            the items of all prefixes can be compared with each other
+        """
+        results = [None] * len(prefixes)
+        # Each entry is (prefix, stop point, whether prefix is in self), and
+        # each prefix in the stack is a prefix of the ones above it.
+        stack = []
+        for i in sorted(range(len(prefixes)), key=lambda j: prefixes[j]):
+            prefix = prefixes[i]
+            while stack and stack[-1][0] != prefix[:len(stack[-1][0])]:
+                stack.pop()
+            if not stack:
+                stop_point, prefix_is_in = self.search_prefix(prefix)
+            elif not stack[-1][2]:
+                stop_point, prefix_is_in = stack[-1][1], False
+            else:
+                previous, tree, _ = stack[-1]
+                stop_point, prefix_is_in = tree.search_prefix(prefix,
+                                                              len(previous))
+            stack.append((prefix, stop_point, prefix_is_in))
+            if prefix_is_in:
+                results[i] = stop_point.autocomplete_here(limit)
+            else:
+                results[i] = []
+        return results
+
+    def autocomplete_here(self, limit: Optional[int] = None) \
+            -> List[Tuple[Any, float]]:
+        """Return up to <limit> leaves in self as (value, weight) tuples, in
+        non-increasing order of weight, using the top-k cache if it can
+        answer.
+        """
+        if self.has_top(limit):
+            return [(leaf.value, leaf.weight) for leaf in self._top[:limit]]
+        return self.autocomplete_helper(limit)
 
     def autocomplete_helper(self, limit: Optional[int] = None) \
             -> List[Tuple[Any, float]]:
-        """Return leafs in self and store the value and weight of the leaf to
-        a list. Once the length of the list meets the limit, will return the
-        list immediately.
+        """Return up to <limit> leaves in self as (value, weight) tuples, in
+        non-increasing order of weight.
+
+        Every tree keeps the weight of its heaviest leaf, which bounds the
+        weight of every leaf below it, so the subtrees are explored
+        best-first and the search stops as soon as <limit> leaves have come
+        off the heap.
         """
+        if self.is_leaf():
+            return [(self.value, self.weight)]
         accumulator = []
-        if limit is None or limit > 0:
-            if self.is_leaf():
-                return [(self.value, self.weight)]
+        heap = []
+        counter = itertools.count()
+        self.push_subtrees(heap, counter)
+        while heap and (limit is None or len(accumulator) < limit):
+            key, _, parent, i, end = heapq.heappop(heap)
+            subtree = parent.subtrees[i]
+            if i + 1 < end:
+                heapq.heappush(heap, (-parent.subtrees[i + 1].weight,
+                                      next(counter), parent, i + 1, end))
+            if subtree.is_leaf():
+                accumulator.append((subtree.value, subtree.weight))
+            elif subtree._max < -key:
+                # The weight of subtree overstates its heaviest leaf, so it
+                # goes back on the heap under the tighter key.
+                heapq.heappush(heap, (-subtree._max, next(counter),
+                                      parent, i, i + 1))
             else:
-                for subtree in self.subtrees:
-                    if limit is not None:
-                        accumulator.extend(subtree.autocomplete_helper(
-                            limit - len(accumulator)))
-                    else:
-                        accumulator.extend(subtree.autocomplete_helper(limit))
-                accumulator = sorted(accumulator,
-                                     key=lambda x: x[1],
-                                     reverse=True)
-                return accumulator
+                subtree.push_subtrees(heap, counter)
+        return accumulator
+
+    def push_subtrees(self, heap: list, counter: Iterator[int]) -> None:
+        """Push the subtrees of self onto <heap>, for autocomplete_helper.
+
+        Each entry holds the subtrees of self from index i up to end, keyed
+        by the negated weight that no leaf in them can exceed, and then by
+        the next number from <counter>, so that ties are broken in the order
+        the entries were pushed.
+
+        When the weight of a subtree bounds the weight of every leaf in it,
+        the sorted subtrees of self share a single entry keyed by the weight
+        of the next one, which only enters the heap once the one before it
+        has come off. Otherwise, each subtree has its own entry, keyed by its
+        heaviest leaf. Either way, a subtree is only searched once it comes
+        off the heap under the weight of its heaviest leaf.
+        """
+        if not self.subtrees:
+            return
+        elif AGGREGATORS[self.weight_type].bounds_leaves:
+            heapq.heappush(heap, (-self.subtrees[0].weight, next(counter),
+                                  self, 0, len(self.subtrees)))
         else:
-            accumulator = sorted(accumulator,
-                                 key=lambda x: x[1],
-                                 reverse=True)
-            return accumulator
+            for i, subtree in enumerate(self.subtrees):
+                heapq.heappush(heap, (-subtree.leaf_max(), next(counter),
+                                      self, i, i + 1))
+
+    def finish_removal(self, removed: set) -> None:
+        """Drop the subtrees of self whose ids are in <removed> or that have no
+        values left, then recompute the weight, length, subtree order, child
+        index and cached top leaves of self, for remove_many.
+        """
+        self.subtrees = [subtree for subtree in self.subtrees
+                         if id(subtree) not in removed and len(subtree) > 0]
+        self.length = sum(len(subtree) for subtree in self.subtrees)
+        if not self.subtrees:
+            self.refresh_weight()
+            self._children = None
+            self.refresh_top()
+            return
+        self._total = sum(subtree.leaf_total() for subtree in self.subtrees)
+        self.finish_built()
 
-    def remove(self, prefix: List) -> None:
-        """Remove all values that match the given prefix.
+    def find_subtree(self, element: Any) -> Optional[SimplePrefixNode]:
+        """Return the non-leaf subtree of self whose value continues self.value
+        with <element>, or None if there is no such subtree.
         """
-        # Need to sort!
-        if not prefix:
-            while len(self.subtrees) != 0:
-                self.subtrees.pop()
-            self.weight = 0.0
-            self.length = 0
+        if self._children is not None:
+            return self._children.get(element)
         for subtree in self.subtrees:
-            if subtree.value == prefix:
-                old_subtree_weight = float(subtree.weight)
-                old_subtree_len = subtree.length
-                old_len = self.length
-                self.subtrees.remove(subtree)
-                self.length = self.length - old_subtree_len
-                if not self.subtrees:
-                    self.weight = 0.0
-                elif self.weight_type == 'sum':
-                    self.weight = float(self.weight - old_subtree_weight)
-                else:
-                    self.weight = (self.weight * old_len - old_subtree_weight *
-                                   old_subtree_len) / self.length
-            elif subtree.isprefix(prefix):
-                old_subtree_len = subtree.length
-                old_len = self.length
-                old_subtree_weight = float(subtree.weight)
-                subtree.remove(prefix)
-                self.length = self.length + (subtree.length - old_subtree_len)
-                if self.length == 0:
-                    self.weight = 0.0
-                elif self.weight_type == 'sum':
-                    self.weight = float(self.weight +
-                                        (subtree.weight - old_subtree_weight))
-                else:
-                    weight_change = \
-                        -(subtree.weight * subtree.length -
-                          old_subtree_weight * old_subtree_len)
-                    self.weight = \
-                        (self.weight * old_len + weight_change) / self.length
-        self.subtrees = sorted(self.subtrees, key=lambda x: x.weight,
-                               reverse=True)
-        self.remove_empty_prefix()
-
-    def remove_empty_prefix(self) -> None:
-        """Remove all the empty prefix(weight == 0)"""
+            if subtree._depth is not None and \
+                    subtree._value[self._depth] == element:
+                return subtree
+        return None
+
+    def index_subtrees(self) -> None:
+        """Rebuild the child index of self from self.subtrees."""
+        if len(self.subtrees) <= INDEX_THRESHOLD:
+            self._children = None
+            return
+        self._children = {}
         for subtree in self.subtrees:
-            if subtree.weight == 0.0:
-                self.subtrees.remove(subtree)
+            if subtree._depth is not None:
+                self._children[subtree._value[self._depth]] = subtree
+
+    def index_subtree(self, subtree: SimplePrefixNode) -> None:
+        """Record <subtree>, which has just been added to self.subtrees (or has
+        just replaced the subtree with the same first element), in the child
+        index of self.
+        """
+        if self._children is None:
+            if len(self.subtrees) > INDEX_THRESHOLD:
+                self.index_subtrees()
+        elif subtree._depth is not None:
+            self._children[subtree._value[self._depth]] = subtree
+
+    def find_position(self, weight: float, start: int, end: int,
+                      inclusive: bool = False) -> int:
+        """Return the first index i in [start, end) such that
+        self.subtrees[i].weight < weight (or <= weight if <inclusive>), or
+        <end> if there is no such index.
+
+        Precondition: self.subtrees[start:end] is sorted in non-increasing
+        order of their weights.
+        """
+        while start < end:
+            mid = (start + end) // 2
+            mid_weight = self.subtrees[mid].weight
+            if mid_weight < weight or (inclusive and mid_weight == weight):
+                end = mid
+            else:
+                start = mid + 1
+        return start
+
+    def add_subtree(self, subtree: SimplePrefixNode) -> None:
+        """Add <subtree> to self.subtrees, keeping them sorted.
+
+        <subtree> goes after every subtree with the same weight, as if it had
+        been appended and the subtrees sorted again.
+        """
+        self.subtrees.insert(
+            self.find_position(subtree.weight, 0, len(self.subtrees)), subtree)
+
+    def move_subtree(self, subtree: SimplePrefixNode,
+                     old_weight: float) -> None:
+        """Move <subtree>, whose weight has just changed from <old_weight>,
+        to its place in self.subtrees.
+
+        Every other subtree keeps its weight, so only <subtree> can be out of
+        order. It is moved past the subtrees it now outweighs (or that now
+        outweigh it), leaving ties in the order a stable sort would.
+        """
+        # <subtree> still sits where <old_weight> put it.
+        index = self.locate_subtree(subtree, old_weight)
+        if subtree.weight > old_weight:
+            new_index = self.find_position(subtree.weight, 0, index)
+        elif subtree.weight < old_weight:
+            new_index = self.find_position(subtree.weight, index + 1,
+                                           len(self.subtrees), True) - 1
+        else:
+            return
+        if new_index != index:
+            self.subtrees.pop(index)
+            self.subtrees.insert(new_index, subtree)
+
+    def locate_subtree(self, subtree: SimplePrefixNode, weight: float) -> int:
+        """Return the index of <subtree> in self.subtrees, where it is sorted
+        as if its weight were <weight>.
+        """
+        # Compare <subtree> by <weight> while searching for it.
+        start, end = 0, len(self.subtrees)
+        while start < end:
+            mid = (start + end) // 2
+            tree = self.subtrees[mid]
+            if tree is subtree or tree.weight <= weight:
+                end = mid
             else:
-                subtree.remove_empty_prefix()
+                start = mid + 1
+        return self.subtrees.index(subtree, start)
+
+    def replace_subtree(self, subtree: SimplePrefixNode,
+                        new_subtree: SimplePrefixNode) -> None:
+        """Put <new_subtree>, which has the same value and weight as
+        <subtree>, in the place of <subtree> in self.subtrees, the child index
+        and the cached top leaves of self.
+        """
+        self.subtrees[self.locate_subtree(subtree, subtree.weight)] = \
+            new_subtree
+        if self._children is not None and subtree._depth is not None:
+            self._children[subtree._value[self._depth]] = new_subtree
+        if subtree.is_leaf():
+            self.replace_top(subtree, new_subtree)
+
+    def replace_top(self, leaf: SimplePrefixNode,
+                    new_leaf: SimplePrefixNode) -> None:
+        """Put <new_leaf> in the place of <leaf> in the cached top leaves of
+        self, if it is there.
+        """
+        if self._top is not None:
+            self._top = [new_leaf if top is leaf else top for top in self._top]
+
+    @classmethod
+    def node_class(cls) -> type:
+        """Return the class of the trees below the root of a prefix tree of
+        this class.
+        """
+        return SimplePrefixNode
+
+    def copy_node(self) -> SimplePrefixNode:
+        """Return a copy of self that shares its subtrees, but not the lists
+        and index that hold them, so that the copy can be changed without
+        changing self.
+        """
+        copy = type(self).__new__(type(self))
+        copy._value = self._value
+        copy._depth = self._depth
+        copy.weight = self.weight
+        copy.subtrees = list(self.subtrees)
+        copy.weight_type = self.weight_type
+        copy.length = self.length
+        copy._children = None if self._children is None \
+            else dict(self._children)
+        copy._top_k = self._top_k
+        copy._top = None if self._top is None else list(self._top)
+        copy._total = self._total
+        copy._max = self._max
+        return copy
+
+    def drop_subtree(self, subtree: SimplePrefixNode, weight: float) -> None:
+        """Remove <subtree>, which is sorted as if its weight were <weight>,
+        from self.subtrees and the child index of self.
+        """
+        self.subtrees.pop(self.locate_subtree(subtree, weight))
+        self.unindex(subtree)
+
+    def unindex(self, subtree: SimplePrefixNode) -> None:
+        """Drop <subtree> from the child index of self, if it is there."""
+        if self._children is not None and subtree._depth is not None and \
+                subtree._depth > self._depth and \
+                self._children.get(subtree._value[self._depth]) is subtree:
+            del self._children[subtree._value[self._depth]]
 
     def assign(self, value: Any, weight: float) -> None:
-        """Assign a value and weight to a PrefixTree."""
-        self.value = value
+        """Assign a value and weight to a leaf of a PrefixTree.
+
+        <value> is stored as it is, even if it is a list, since only
+        non-leaf trees hold prefixes.
+        """
+        self._value = value
+        self._depth = None
         self.weight = float(weight)
 
+    def has_top(self, limit: Optional[int]) -> bool:
+        """Return whether the cached top leaves of self answer a query for
+        <limit> results.
+        """
+        return self._top is not None and limit is not None and \
+            limit <= self._top_k
 
-################################################################################
-# CompressedPrefixTree (Task 6)
-################################################################################
-class CompressedPrefixTree(SimplePrefixTree):
-    """A compressed prefix tree implementation.
+    def top_candidates(self) -> List[SimplePrefixNode]:
+        """Return the leaves of self that may be among the cached top leaves
+        of its parent.
+        """
+        if self.is_leaf():
+            return [self]
+        return self._top
 
-    While this class has the same public interface as SimplePrefixTree,
-    (including the initializer!) this version follows the implementation
-    described on Task 6 of the assignment handout, which reduces the number of
-    tree objects used to store values in the tree.
+    def merge_top(self, subtree: SimplePrefixNode) -> None:
+        """Update the cached top leaves of self after the weight of a leaf in
+        <subtree> has increased, or a leaf has been added to <subtree>.
 
-    === Attributes ===
-    value:
-        The value stored at the root of this prefix tree, or [] if this
-        prefix tree is empty.
-    weight:
-        The weight of this prefix tree. If this tree is a leaf, this attribute
-        stores the weight of the value stored in the leaf. If this tree is
-        not a leaf and non-empty, this attribute stores the *aggregate weight*
-        of the leaf weights in this tree.
-    subtrees:
-        A list of subtrees of this prefix tree.
-    weight_type: A str records what kind of aggregate weight it is.
-    length: A int that records how many leaves are in the tree.
+        Every leaf outside of <subtree> is unchanged, so only the candidates of
+        <subtree> can enter the cache.
+        """
+        if self._top is None:
+            return
+        merged = {id(leaf): leaf for leaf in self._top}
+        for leaf in subtree.top_candidates():
+            merged[id(leaf)] = leaf
+        self._top = heapq.nlargest(self._top_k, merged.values(),
+                                   key=lambda x: x.weight)
+
+    def merge_top_along(self, prefix: List, leaf: SimplePrefixNode) -> None:
+        """Merge <leaf> into the cached top leaves of self and of every tree
+        on the path from self down to <prefix>.
+        """
+        tree = self
+        tree.merge_top(leaf)
+        for element in prefix[self._depth:]:
+            tree = tree.find_subtree(element)
+            tree.merge_top(leaf)
+
+    def refresh_top(self) -> None:
+        """Recompute the cached top leaves of self from its subtrees."""
+        if self._top is None:
+            return
+        candidates = []
+        for subtree in self.subtrees:
+            candidates.extend(subtree.top_candidates())
+        self._top = heapq.nlargest(self._top_k, candidates,
+                                   key=lambda x: x.weight)
 
-    === Representation invariants ===
-    - self.weight >= 0
+    def save(self, path: str) -> None:
+        """Write a snapshot of this prefix tree to the file <path>.
 
-    - (EMPTY TREE):
-        If self.weight == 0, then self.value == [] and self.subtrees == [].
-        This represents an empty simple prefix tree.
-    - (LEAF):
-        If self.subtrees == [] and self.weight > 0, this tree is a leaf.
-        (self.value is a value that was inserted into this tree.)
-    - (NON-EMPTY, NON-LEAF):
-        If len(self.subtrees) > 0, then self.value is a list (*common prefix*),
-        and self.weight > 0 (*aggregate weight*).
+        The snapshot can be loaded with MappedPrefixTree.load, which answers
+        autocomplete queries straight from the file. The values stored in this
+        tree and the items of its prefixes must be picklable.
+        """
+        # Trees are numbered in breadth-first order, so that the subtrees of
+        # each tree get consecutive numbers.
+        trees = [self]
+        parent_depths = [0]
+        records = []
+        labels = []
+        lookups = []
+        values = []
+        elements = {}
+        index = 0
+        while index < len(trees):
+            tree = trees[index]
+            parent_depth = parent_depths[index]
+            index += 1
+            if tree.is_leaf():
+                records.append(_NODE.pack(tree.weight, 1, 0, 0, len(values),
+                                          0, 0, 0))
+                values.append(pickle.dumps(tree.value))
+                continue
+            label_start = len(labels)
+            for element in tree._value[parent_depth:tree._depth]:
+                labels.append(elements.setdefault(element, len(elements)))
+            first_child = len(trees)
+            lookup = []
+            for i in range(len(tree.subtrees)):
+                subtree = tree.subtrees[i]
+                if not subtree.is_leaf():
+                    element = subtree._value[tree._depth]
+                    lookup.append((elements.setdefault(element, len(elements)),
+                                   first_child + i))
+                trees.append(subtree)
+                parent_depths.append(tree._depth)
+            records.append(_NODE.pack(
+                tree.weight, tree.length, first_child, len(tree.subtrees),
+                label_start, len(labels) - label_start, len(lookups) // 2,
+                len(lookup)))
+            for element_id, child in sorted(lookup):
+                lookups.extend([element_id, child])
+
+        value_offsets = [0]
+        for value in values:
+            value_offsets.append(value_offsets[-1] + len(value))
+        meta = pickle.dumps((self.weight_type, list(elements)))
+        labels_start = _HEADER.size + _NODE.size * len(records)
+        lookups_start = labels_start + _U32.size * len(labels)
+        offsets_start = lookups_start + _U32.size * len(lookups)
+        values_start = offsets_start + _U64.size * len(value_offsets)
+        meta_start = values_start + value_offsets[-1]
+        with open(path, 'wb') as f:
+            f.write(_HEADER.pack(SNAPSHOT_MAGIC, len(records), labels_start,
+                                 lookups_start, offsets_start, values_start,
+                                 meta_start))
+            f.write(b''.join(records))
+            f.write(struct.pack(f'<{len(labels)}I', *labels))
+            f.write(struct.pack(f'<{len(lookups)}I', *lookups))
+            f.write(struct.pack(f'<{len(value_offsets)}Q', *value_offsets))
+            f.write(b''.join(values))
+            f.write(meta)
+
+
+class SimplePrefixTree(SimplePrefixNode, Autocompleter):
+    """A simple prefix tree, as described in SimplePrefixNode, whose subtrees
+    are SimplePrefixNodes.
+
+    Only the root of a tree needs the private attributes below, so only the
+    root keeps them, rather than every tree below it, and only the root has
+    the methods that use them.
+
+    === Private Attributes ===
+    _version:
+        The number of times insert or remove has been called on this tree,
+        so that a TreeCursor can tell when the trees it remembers may have
+        changed.
+    _index:
+        The ValueIndex of the values stored in this tree, or None if it has
+        not been built, as it is only built once contains, update_weight or
+        remove_value is called.
+    """
+    _version: int
+    _index: Optional[ValueIndex]
 
-    - **NEW**
-      This tree does not contain any compressible internal values.
-      (See the assignment handout for a definition of "compressible".)
+    __slots__ = ('_version', '_index')
 
-    - self.subtrees does not contain any empty prefix trees.
-    - self.subtrees is *sorted* in non-increasing order of their weights.
-      (You can break ties any way you like.)
-      Note that this applies to both leaves and non-leaf subtrees:
-      both can appear in the same self.subtrees list, and both have a `weight`
-      attribute.
-    """
-    value: Any
-    weight: float
-    subtrees: List[CompressedPrefixTree]
-    weight_type: str
-    length: int
+    def __init__(self, weight_type: str, top_k: Optional[int] = None) -> None:
+        """Initialize an empty simple prefix tree.
 
-    def isprefix(self, prefix: List) -> bool:
-        """Check whether self.value is the prefix of the 'prefix'"""
-        if self.is_leaf():
-            return False
-        elif len(self.value) > len(prefix):
-            return False
-        else:
-            return all([self.value[i] == prefix[i] for i in
-                        range(len(self.value))])
+        See SimplePrefixNode.__init__.
+        """
+        super().__init__(weight_type, top_k)
+        self._version = 0
+        self._index = None
+
+    def copy_node(self) -> SimplePrefixTree:
+        """Return a copy of self that shares its subtrees, but not the lists
+        and index that hold them, so that the copy can be changed without
+        changing self.
+        """
+        copy = SimplePrefixNode.copy_node(self)
+        copy._version = self._version
+        # The index of self holds the leaves of self, some of which the copy
+        # will replace, so the copy builds its own if it needs one.
+        copy._index = None
+        return copy
 
     def insert(self, value: Any, weight: float, prefix: List) -> None:
         """Insert the given value into this Autocompleter.
@@ -500,432 +1189,1506 @@ class CompressedPrefixTree(SimplePrefixTree):
                 1) not in this Autocompleter
                 2) was previously inserted with the SAME prefix sequence
         """
-        if self.is_empty():
-            self.assign(prefix, weight)
-            new_leaf = CompressedPrefixTree(self.weight_type)
-            new_leaf.assign(value, weight)
-            self.subtrees.append(new_leaf)
-            self.length = 1
-            return
-        elif self.value != [] and all([prefix[i] != self.value[i] for i in
-                                       range(min(len(prefix),
-                                                 len(self.value)))]):
-            self.com_insert_case_1_helper(value, prefix, weight)
-            return
-        elif self.value == prefix:
-            for subtree in self.subtrees:
-                if subtree.value == value:
-                    self.com_insert_case_2_helper(subtree, weight)
-                    return
-            self.com_insert_case_3_helper(value, weight)
-            return
-        elif len(self.value) >= len(prefix) and all([self.value[i] == prefix[i]
-                                                     for i in
-                                                     range(len(prefix))]):
-            self.com_insert_case_4_helper(value, prefix, weight)
-            return
-        elif len(self.value) >= len(prefix):
-            common_part = self.get_common_part(prefix)
-            if all([self.value[i] == common_part[i] for i in
-                    range(len(common_part))]):
-                self.com_insert_case_5_helper(
-                    value, prefix, weight, common_part)
-                return
-        elif all([self.value[i] == prefix[i] for i in range(len(self.value))]):
-            for subtree in self.subtrees:
-                if subtree.isprefix(prefix):
-                    old_subtree_length = subtree.length
-                    subtree.insert(value, weight, prefix)
-                    self.length = self.length + (subtree.length -
-                                                 old_subtree_length)
-                    self.update_weight(weight,
-                                       (subtree.length - old_subtree_length))
-                    self.subtrees = sorted(self.subtrees,
-                                           key=lambda x: x.weight,
-                                           reverse=True)
-                    return
-                elif not subtree.is_leaf():
-                    if self.com_insert_case_6_helper(
-                            value, prefix, weight, subtree):
-                        return
-                    elif self.com_insert_case_7_helper(
-                            value, prefix, weight, subtree):
-                        return
-            self.com_insert_case_8_helper(value, prefix, weight)
-            return
-        else:
-            common_part = self.get_common_part(prefix)
-            self.com_insert_case_9_helper(value, prefix, weight, common_part)
+        self._version += 1
+        if self._index is not None and self._index.find(value) is not None:
+            self.update_weight(value, weight)
             return
+        # Walk down along prefix as far as the tree goes, remembering each
+        # subtree's length and weight before the insertion so that its parent
+        # can be updated on the way back up.
+        path = []
+        tree = self
+        if tree.isprefix(prefix):
+            subtree = tree.next_subtree(prefix)
+            while subtree is not None:
+                path.append((tree, subtree, subtree.length, subtree.weight))
+                tree = subtree
+                subtree = tree.next_subtree(prefix)
+        leaf = tree.insert_here(value, weight, prefix,
+                                self._index is not None)
+        for parent, subtree, old_length, old_weight in reversed(path):
+            parent.length = parent.length + (subtree.length - old_length)
+            parent.move_subtree(subtree, old_weight)
+            parent.adjust_weight(weight, leaf.weight)
+            parent.merge_top(subtree)
+        if self._index is not None:
+            self._index.add(leaf, prefix)
+
+    def index_values(self, key: Optional[Callable[[Any], Any]] = None) \
+            -> None:
+        """Index the values stored in this tree by <key>, or by the values
+        themselves if <key> is None, so that the leaf of a value is found
+        without searching the tree for it.
+
+        contains, update_weight and remove_value build the index with no
+        <key> the first time they are called, if this method has not been.
+        From then on, insert, remove and remove_many keep it up to date, and
+        insert uses it to tell whether a value is already in this tree.
 
-    def com_insert_case_1_helper(self, value: Any,
-                                 prefix: List, weight: float) -> None:
-        """Case 1
-        only happens when the top is not [].
+        Precondition: two values have equal keys exactly when they are equal.
         """
-        temp_self = CompressedPrefixTree(self.weight_type)
-        temp_self.assign(self.value, self.weight)
-        temp_self.subtrees = self.subtrees
-        temp_self.length = self.length
-        if not prefix:
-            new_leaf = CompressedPrefixTree(self.weight_type)
-            new_leaf.assign(value, weight)
-            self.value = []
-            if self.weight_type == 'average':
-                self.weight = (self.weight * self.length + weight) / \
-                              (self.length + 1)
+        index = ValueIndex(key)
+        stack = [self]
+        while stack:
+            tree = stack.pop()
+            for subtree in tree.subtrees:
+                if subtree.is_leaf():
+                    index.add(subtree, tree._value[:tree._depth])
+                else:
+                    stack.append(subtree)
+        self._index = index
+
+    def value_index(self) -> ValueIndex:
+        """Return the value index of this tree, building it if needed."""
+        if self._index is None:
+            self.index_values()
+        return self._index
+
+    def contains(self, value: Any) -> bool:
+        """Return whether <value> is stored in this tree."""
+        return self.value_index().find(value) is not None
+
+    def update_weight(self, value: Any, delta: float) -> None:
+        """Add <delta>, which may be negative, to the weight of <value>.
+
+        Only the trees on the path down to the leaf of <value> are updated.
+
+        Preconditions:
+            <value> is in this tree
+            the weight of <value> plus <delta> is > 0
+        """
+        leaf, prefix = self.value_index().find(value)
+        child, old_child_weight = leaf, leaf.weight
+        old_leaf_weight = leaf.weight
+        leaf.weight = float(leaf.weight + delta)
+        for tree in reversed(self.path_to(prefix)):
+            old_weight = tree.weight
+            tree.move_subtree(child, old_child_weight)
+            if delta > 0:
+                tree.adjust_weight(delta, leaf.weight)
+                tree.merge_top(child)
             else:
-                self.weight = float(self.weight + weight)
-                self.subtrees = [temp_self, new_leaf]
-                self.length = self.length + 1
-                self.subtrees = sorted(self.subtrees, key=lambda x: x.weight,
-                                       reverse=True)
-        else:
-            new_prefix = CompressedPrefixTree(self.weight_type)
-            new_prefix.assign(prefix, weight)
-            new_leaf = CompressedPrefixTree(self.weight_type)
-            new_leaf.assign(value, weight)
-            new_prefix.subtrees.append(new_leaf)
-            new_prefix.length = new_prefix.length + 1
-            self.value = []
-            if self.weight_type == 'average':
-                self.weight = (self.weight * self.length + weight) / \
-                              (self.length + 1)
+                tree.lose_weight(old_leaf_weight - leaf.weight,
+                                 old_leaf_weight)
+                tree.refresh_top()
+            child, old_child_weight = tree, old_weight
+
+    def remove_value(self, value: Any) -> None:
+        """Remove <value> from this tree, if it is there.
+
+        Only the trees on the path down to the leaf of <value> are updated.
+        """
+        index = self.value_index()
+        entry = index.find(value)
+        if entry is None:
+            return
+        self._version += 1
+        leaf, prefix = entry
+        index.discard(value)
+        child, old_child_weight = leaf, leaf.weight
+        for tree in reversed(self.path_to(prefix)):
+            old_weight = tree.weight
+            tree.length = tree.length - 1
+            if child is leaf or child.length == 0:
+                tree.drop_subtree(child, old_child_weight)
             else:
-                self.weight = float(self.weight + weight)
-            self.subtrees = [temp_self, new_prefix]
-            self.length = self.length + 1
-            self.subtrees = sorted(self.subtrees, key=lambda x: x.weight,
-                                   reverse=True)
+                tree.move_subtree(child, old_child_weight)
+            tree.lose_weight(leaf.weight, leaf.weight)
+            tree.remove_helper()
+            tree.refresh_top()
+            child, old_child_weight = tree, old_weight
+        if not self.subtrees:
+            self.value = []
 
-    def com_insert_case_2_helper(
-            self, subtree: CompressedPrefixTree, weight: float) -> None:
-        """case 2
-        The value is in the tree.
+    def forget_values(self, trees: Iterable[SimplePrefixNode]) -> None:
+        """Drop every value stored in <trees>, which have just been removed
+        from this tree, from the value index of this tree, if it has one.
         """
-        subtree.weight = (subtree.weight + weight)
-        self.update_weight(weight, 0)
-        self.subtrees = sorted(self.subtrees,
-                               key=lambda x: x.weight,
-                               reverse=True)
+        if self._index is None:
+            return
+        stack = list(trees)
+        while stack:
+            tree = stack.pop()
+            if tree.is_leaf():
+                self._index.discard(tree.value)
+            else:
+                stack.extend(tree.subtrees)
+
+    @classmethod
+    def from_items(cls, weight_type: str,
+                   items: Iterable[Tuple[Any, float, List]],
+                   top_k: Optional[int] = None) -> SimplePrefixTree:
+        """Return a new prefix tree with the given <weight_type> and <top_k>
+        that holds the (value, weight, prefix) triples in <items>.
 
-    def com_insert_case_3_helper(self, value: Any, weight: float) -> None:
-        """Case 3
-        The prefix is in. But the value that consists of every item in the
-        prefix does not exist.
+        The result is the same as inserting the triples one at a time (up to
+        the order of subtrees with equal weights), but the tree is built
+        bottom-up in a single pass: duplicate values are aggregated first,
+        and every tree's subtrees are sorted once.
+
+        Preconditions:
+            every weight > 0
+            a value that appears more than once always has the same prefix
+            the prefix elements can be compared with <
         """
-        new_leaf = CompressedPrefixTree(self.weight_type)
-        new_leaf.assign(value, weight)
-        self.subtrees.append(new_leaf)
-        self.length = self.length + 1
-        self.update_weight(weight, 1)
-        self.subtrees = sorted(self.subtrees, key=lambda x: x.weight,
-                               reverse=True)
-
-    def com_insert_case_4_helper(self, value: Any,
-                                 prefix: List, weight: float) -> None:
-        """Case 4
-        Prefix is the prefix of 'self'.
-        """
-        temp_self = CompressedPrefixTree(self.weight_type)
-        temp_self.assign(self.value, self.weight)
-        temp_self.subtrees = self.subtrees
-        temp_self.length = self.length
-        new_leaf = CompressedPrefixTree(self.weight_type)
-        new_leaf.assign(value, weight)
-        self.value = prefix
-        self.length = self.length + 1
-        self.update_weight(weight, 1)
-        self.subtrees = [temp_self, new_leaf]
-        self.subtrees = sorted(self.subtrees, key=lambda x: x.weight,
-                               reverse=True)
+        return cls.build(weight_type, items, top_k, False)
 
-    def com_insert_case_5_helper(
-            self, value: Any, prefix: List, weight: float, common_part: List) \
-            -> None:
-        """Case 5
-        len(self.value) >= len(prefix), no need to recursive.
-        And common_part is the prefix of both of them
-        """
-        temp_self = CompressedPrefixTree(self.weight_type)
-        temp_self.assign(self.value, self.weight)
-        temp_self.subtrees = self.subtrees
-        temp_self.length = self.length
-        new_prefix = CompressedPrefixTree(self.weight_type)
-        new_prefix.assign(prefix, weight)
-        new_leaf = CompressedPrefixTree(self.weight_type)
-        new_leaf.assign(value, weight)
-        new_prefix.subtrees.append(new_leaf)
-        new_prefix.length = new_prefix.length + 1
-        self.value = common_part
-        self.length = self.length + 1
-        self.update_weight(weight, 1)
-        self.subtrees = [temp_self, new_prefix]
-        self.subtrees = sorted(self.subtrees, key=lambda x: x.weight,
-                               reverse=True)
-
-    def com_insert_case_6_helper(
-            self, value: Any, prefix: List, weight: float,
-            subtree: CompressedPrefixTree) -> bool:
-        """Case 6
-        common_part between subtree and prefix must contain self.value.
-        """
-        common_part = subtree.get_common_part(prefix)
-        if common_part != [] and len(common_part) > len(self.value) \
-                and common_part != prefix:
-            index = self.subtrees.index(subtree)
-            new_parent = CompressedPrefixTree(self.weight_type)
-            new_parent.assign(common_part, 1)
-            new_prefix = CompressedPrefixTree(self.weight_type)
-            new_prefix.assign(prefix, weight)
-            new_leaf = CompressedPrefixTree(self.weight_type)
-            new_leaf.assign(value, weight)
-            new_prefix.subtrees.append(new_leaf)
-            new_prefix.length = new_prefix.length + 1
-            new_parent.subtrees = [subtree, new_prefix]
-            new_parent.subtrees = sorted(new_parent.subtrees,
-                                         key=lambda x: x.weight,
-                                         reverse=True)
-            new_parent.length = subtree.length + 1
-            self.length = self.length + 1
-            if self.weight_type == 'average':
-                new_parent.weight = \
-                    (subtree.weight * subtree.length + weight) \
-                    / new_parent.length
-                self.weight = \
-                    (self.weight * (self.length - 1) + weight) \
-                    / self.length
+    @classmethod
+    def build(cls, weight_type: str, items: Iterable[Tuple[Any, float, List]],
+              top_k: Optional[int], compress: bool) -> SimplePrefixTree:
+        """Return a new prefix tree holding <items>, as described in
+        from_items.
+
+        If <compress> is True, a non-root tree whose only subtree is not a leaf
+        is replaced by that subtree.
+        """
+        groups = cls.group_items(weight_type, items)
+        # Building only allocates trees that stay alive, so pausing the cyclic
+        # garbage collector saves it from rescanning them over and over. It
+        # is paused only once <items>, which may be read from a file, have
+        # all been grouped.
+        gc_was_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            return cls.build_groups(weight_type, groups, top_k, compress)
+        finally:
+            if gc_was_enabled:
+                gc.enable()
+
+    @classmethod
+    def group_items(cls, weight_type: str,
+                    items: Iterable[Tuple[Any, float, List]]) \
+            -> Dict[tuple, List[SimplePrefixNode]]:
+        """Return a dictionary mapping each prefix in <items> (as a tuple) to
+        leaves for the values with that prefix, with the weights of duplicate
+        values added together.
+        """
+        groups = {}
+        for value, weight, prefix in items:
+            leaves = groups.setdefault(tuple(prefix), [])
+            matches = [leaf for leaf in leaves if leaf.value == value]
+            if matches:
+                matches[0].weight = float(matches[0].weight + weight)
             else:
-                new_parent.weight = float(subtree.weight +
-                                          weight)
-                self.weight = float(self.weight + weight)
-            self.subtrees[index] = new_parent
-            self.subtrees = sorted(self.subtrees,
-                                   key=lambda x: x.weight,
-                                   reverse=True)
-            return True
-        else:
-            return False
+                new_leaf = cls.node_class()(weight_type)
+                new_leaf.assign(value, weight)
+                leaves.append(new_leaf)
+        return groups
+
+    @classmethod
+    def build_groups(cls, weight_type: str,
+                     groups: Dict[tuple, List[SimplePrefixNode]],
+                     top_k: Optional[int], compress: bool) -> SimplePrefixTree:
+        """Return a new prefix tree holding the leaves in <groups>, which maps
+        each prefix (as a tuple) to the leaves with that prefix.
+
+        See build for <compress>.
+        """
+        # path[d] is the unfinished tree whose value is the first d elements
+        # of the current prefix. Until it is finished, only its length and
+        # total are kept up to date.
+        root = cls(weight_type, top_k)
+        path = [root]
+        previous = ()
+        for prefix in sorted(groups):
+            common = 0
+            while common < min(len(prefix), len(previous)) and \
+                    prefix[common] == previous[common]:
+                common += 1
+            while len(path) > common + 1:
+                subtree = path.pop()
+                path[-1].add_built_subtree(subtree, compress)
+            while len(path) <= len(prefix):
+                new_common_prefix = cls.node_class()(weight_type, top_k)
+                new_common_prefix.assign_prefix(prefix, len(path))
+                path.append(new_common_prefix)
+            for leaf in groups[prefix]:
+                path[-1].subtrees.append(leaf)
+                path[-1].length = path[-1].length + 1
+                path[-1]._total = path[-1]._total + leaf.weight
+            previous = prefix
+        while len(path) > 1:
+            subtree = path.pop()
+            path[-1].add_built_subtree(subtree, compress)
+        if root.subtrees:
+            root.finish_built()
+        return root
+
+    def cursor(self) -> TreeCursor:
+        """Return a new TreeCursor over self, at the empty prefix."""
+        return TreeCursor(self)
 
-    def com_insert_case_7_helper(
-            self, value: Any, prefix: List, weight: float,
-            subtree: CompressedPrefixTree) -> bool:
-        """Case 7
-        common_part between subtree and prefix does not contain self.value.
-        """
-        common_part = subtree.get_common_part(prefix)
-        if common_part != [] and len(common_part) > len(self.value) \
-                and common_part == prefix:
-            index = self.subtrees.index(subtree)
-            new_prefix = CompressedPrefixTree(self.weight_type)
-            new_prefix.assign(prefix, weight)
-            new_leaf = CompressedPrefixTree(self.weight_type)
-            new_leaf.assign(value, weight)
-            new_prefix.subtrees = [subtree, new_leaf]
-            new_prefix.subtrees = sorted(new_prefix.subtrees,
-                                         key=lambda x: x.weight,
-                                         reverse=True)
-            new_prefix.length = subtree.length + 1
-            self.length += 1
-            if self.weight_type == 'average':
-                new_prefix.weight = (subtree.weight *
-                                     subtree.length + weight) \
-                                    / new_prefix.length
-                self.weight = (self.weight * (self.length - 1)
-                               + weight) / self.length
+    def remove(self, prefix: List) -> None:
+        """Remove all values that match the given prefix.
+        """
+        self._version += 1
+        if not prefix:
+            while len(self.subtrees) != 0:
+                self.subtrees.pop()
+            if self._index is not None:
+                self._index.clear()
+            self._children = None
+            self.weight = 0.0
+            self.length = 0
+            self._total = 0.0
+            self._max = 0.0
+            self.refresh_top()
+            return
+        # Walk down to the tree holding the subtree whose value is prefix,
+        # remembering each subtree's weight before the removal so that its
+        # parent can be updated on the way back up.
+        path = []
+        tree = self
+        subtree = tree.next_subtree(prefix)
+        while subtree is not None and subtree._depth < len(prefix):
+            path.append((tree, subtree, subtree.weight))
+            tree = subtree
+            subtree = tree.next_subtree(prefix)
+        if subtree is None:
+            return
+        # Every tree on the path loses the leaves of subtree.
+        removed_length = subtree.length
+        removed_total = subtree.leaf_total()
+        removed_max = subtree.leaf_max()
+        tree.drop_subtree(subtree, subtree.weight)
+        self.forget_values([subtree])
+        tree.length = tree.length - removed_length
+        tree.lose_weight(removed_total, removed_max)
+        tree.refresh_top()
+        # Only the trees on the path have changed. One that has lost all of
+        # its leaves is dropped from its parent, so no empty tree is left.
+        for parent, subtree, old_subtree_weight in reversed(path):
+            parent.length = parent.length - removed_length
+            if subtree.length == 0:
+                parent.drop_subtree(subtree, old_subtree_weight)
             else:
-                new_prefix.weight = float(subtree.weight +
-                                          weight)
-                self.weight = float(self.weight + weight)
-            self.subtrees[index] = new_prefix
-            self.subtrees = sorted(self.subtrees,
-                                   key=lambda x: x.weight,
-                                   reverse=True)
-            return True
-        else:
+                parent.move_subtree(subtree, old_subtree_weight)
+            parent.lose_weight(removed_total, removed_max)
+            parent.refresh_top()
+
+    def remove_many(self, prefixes: List[List]) -> None:
+        """Remove all values that match any of the given prefixes.
+
+        The prefixes are sorted, so that the trees they lead to are all found
+        in one walk down the tree, and every tree that loses values has its
+        weight, length and subtree order recomputed once.
+
+        Precondition: the items of all prefixes can be compared with each
+        other.
+        """
+        self._version += 1
+        # A prefix that starts with another one matches nothing more.
+        kept = []
+        for prefix in sorted(prefixes):
+            if not kept or kept[-1] != prefix[:len(kept[-1])]:
+                kept.append(prefix)
+        if not kept:
+            return
+        elif not kept[0]:
+            self.remove(kept[0])
+            return
+        # Each tree in changed is listed before its subtrees, with the ids of
+        # its subtrees that are removed as a whole.
+        changed = []
+        dropped = []
+        stack = [(self, kept)]
+        while stack:
+            tree, group = stack.pop()
+            removed = set()
+            for element, same in itertools.groupby(
+                    group, key=operator.itemgetter(tree._depth)):
+                subtree = tree.find_subtree(element)
+                if subtree is None:
+                    continue
+                below = []
+                for prefix in same:
+                    if not subtree.agrees_with(prefix, tree._depth + 1):
+                        continue
+                    elif len(prefix) <= subtree._depth:
+                        removed.add(id(subtree))
+                        dropped.append(subtree)
+                        below = []
+                        break
+                    below.append(prefix)
+                if below:
+                    stack.append((subtree, below))
+            changed.append((tree, removed))
+        for tree, removed in reversed(changed):
+            tree.finish_removal(removed)
+        self.forget_values(dropped)
+
+
+class TreeCursor(PrefixCursor):
+    """A PrefixCursor over a SimplePrefixTree or CompressedPrefixTree that
+    remembers where the search for each prefix of its current prefix stopped.
+
+    Advancing resumes the search from where it stopped for the previous
+    prefix, and retreating goes back to the stop point that was remembered,
+    so each keystroke takes constant time however long the prefix is. If
+    the tree has been changed since, the stop points are found again.
+
+    === Private Attributes ===
+    _stops:
+        For each i < len(self._stops), the result of
+        self.autocompleter.search_prefix(self.prefix[:i]) as a
+        (tree, prefix_is_in) tuple. len(self._stops) <= len(self.prefix) + 1.
+    _version:
+        The _version of the tree when _stops was found.
+    """
+    autocompleter: SimplePrefixTree
+    _stops: List[Tuple[SimplePrefixNode, bool]]
+    _version: int
+
+    __slots__ = ('_stops', '_version')
+
+    def __init__(self, tree: SimplePrefixTree) -> None:
+        """Initialize a cursor over <tree>, at the empty prefix."""
+        PrefixCursor.__init__(self, tree)
+        self._stops = []
+        self._version = tree._version
+
+    def advance(self, element: Any) -> None:
+        """Extend the current prefix by <element>."""
+        self.prefix.append(element)
+        if len(self._stops) == len(self.prefix) and \
+                self._version == self.autocompleter._version:
+            self._stops.append(self.next_stop(self.prefix))
+
+    def retreat(self) -> None:
+        """Remove the last element of the current prefix.
+
+        Precondition: self.prefix != []
+        """
+        self.prefix.pop()
+        del self._stops[len(self.prefix) + 1:]
+
+    def autocomplete(self, limit: Optional[int] = None) \
+            -> List[Tuple[Any, float]]:
+        """Return up to <limit> matches for the current prefix, as
+        self.autocompleter.autocomplete(self.prefix, limit) would.
+
+        Precondition: limit is None or limit > 0.
+        """
+        if self._version != self.autocompleter._version:
+            self._stops = []
+            self._version = self.autocompleter._version
+        while len(self._stops) <= len(self.prefix):
+            self._stops.append(self.next_stop(
+                self.prefix[:len(self._stops)]))
+        stop_point, prefix_is_in = self._stops[-1]
+        if prefix_is_in is False:
+            return []
+        return stop_point.autocomplete_here(limit)
+
+    def next_stop(self, prefix: List) -> Tuple[SimplePrefixNode, bool]:
+        """Return where the search for <prefix> stops, resuming from where it
+        stopped for <prefix> without its last element.
+
+        Precondition: len(self._stops) == len(prefix)
+        """
+        if not self._stops:
+            return self.autocompleter.search_prefix(prefix)
+        stop_point, prefix_is_in = self._stops[-1]
+        if prefix_is_in is False:
+            return stop_point, False
+        return stop_point.search_prefix(prefix, len(prefix) - 1)
+
+
+################################################################################
+# ValueIndex
+################################################################################
+class ValueIndex:
+    """An index from the values stored in a prefix tree to their leaves.
+
+    A value is found by its key, which is the value itself unless a key
+    function is given. Values with hashable keys are kept in a dict; the rest
+    are kept in a list and compared by key one at a time.
+
+    === Attributes ===
+    key:
+        The function that gives the key of a value, or None if every value is
+        its own key.
+
+    === Private Attributes ===
+    _entries:
+        Maps the key of each value whose key is hashable to the leaf of the
+        value and its prefix, as a tuple.
+    _others:
+        The leaf and prefix of each value whose key is not hashable.
+    """
+    key: Optional[Callable[[Any], Any]]
+    _entries: Dict[Any, Tuple[SimplePrefixNode, tuple]]
+    _others: List[Tuple[SimplePrefixNode, tuple]]
+
+    __slots__ = ('key', '_entries', '_others')
+
+    def __init__(self, key: Optional[Callable[[Any], Any]] = None) -> None:
+        """Initialize an empty index that finds values by <key>."""
+        self.key = key
+        self._entries = {}
+        self._others = []
+
+    def __len__(self) -> int:
+        """Return the number of values in this index."""
+        return len(self._entries) + len(self._others)
+
+    def key_of(self, value: Any) -> Any:
+        """Return the key of <value>."""
+        return value if self.key is None else self.key(value)
+
+    def find(self, value: Any) -> Optional[Tuple[SimplePrefixNode, tuple]]:
+        """Return the leaf of <value> and its prefix, or None if <value> is
+        not in this index.
+        """
+        key = self.key_of(value)
+        try:
+            return self._entries.get(key)
+        except TypeError:
+            for entry in self._others:
+                if self.key_of(entry[0].value) == key:
+                    return entry
+            return None
+
+    def add(self, leaf: SimplePrefixNode, prefix: Sequence) -> None:
+        """Record <leaf>, whose value has <prefix>, in this index.
+
+        Precondition: the value of <leaf> is not in this index.
+        """
+        entry = (leaf, tuple(prefix))
+        try:
+            self._entries[self.key_of(leaf.value)] = entry
+        except TypeError:
+            self._others.append(entry)
+
+    def discard(self, value: Any) -> None:
+        """Remove <value> from this index, if it is there."""
+        key = self.key_of(value)
+        try:
+            self._entries.pop(key, None)
+        except TypeError:
+            self._others = [entry for entry in self._others
+                            if self.key_of(entry[0].value) != key]
+
+    def clear(self) -> None:
+        """Remove every value from this index."""
+        self._entries = {}
+        self._others = []
+
+
+################################################################################
+# CompressedPrefixTree (Task 6)
+################################################################################
+class CompressedPrefixNode(SimplePrefixNode):
+    """A tree in a compressed prefix tree: either the root, which is a
+    CompressedPrefixTree, or one of the trees below it.
+
+    While this class has the same public interface as SimplePrefixTree,
+    (including the initializer!) this version follows the implementation
+    described on Task 6 of the assignment handout, which reduces the number of
+    tree objects used to store values in the tree.
+
+    === Attributes ===
+    value:
+        The value stored at the root of this prefix tree, or [] if this
+        prefix tree is empty.
+    weight:
+        The weight of this prefix tree. If this tree is a leaf, this attribute
+        stores the weight of the value stored in the leaf. If this tree is
+        not a leaf and non-empty, this attribute stores the *aggregate weight*
+        of the leaf weights in this tree.
+    subtrees:
+        A list of subtrees of this prefix tree.
+    weight_type: A str records what kind of aggregate weight it is.
+    length: A int that records how many leaves are in the tree.
+
+    === Private Attributes ===
+    The same as those of SimplePrefixNode. Here self._children is keyed on the
+    first element of the part of a subtree's value that follows self.value.
+
+    === Representation invariants ===
+    - self.weight >= 0
+
+    - (EMPTY TREE):
+        If self.weight == 0, then self.value == [] and self.subtrees == [].
+        This represents an empty simple prefix tree.
+    - (LEAF):
+        If self.subtrees == [] and self.weight > 0, this tree is a leaf.
+        (self.value is a value that was inserted into this tree.)
+    - (NON-EMPTY, NON-LEAF):
+        If len(self.subtrees) > 0, then self.value is a list (*common prefix*),
+        and self.weight > 0 (*aggregate weight*).
+
+    - **NEW**
+      This tree does not contain any compressible internal values.
+      (See the assignment handout for a definition of "compressible".)
+
+    - self.subtrees does not contain any empty prefix trees.
+    - self.subtrees is *sorted* in non-increasing order of their weights.
+      (You can break ties any way you like.)
+      Note that this applies to both leaves and non-leaf subtrees:
+      both can appear in the same self.subtrees list, and both have a `weight`
+      attribute.
+    """
+    value: Any
+    weight: float
+    subtrees: List[CompressedPrefixNode]
+    weight_type: str
+    length: int
+
+    __slots__ = ()
+
+    @classmethod
+    def node_class(cls) -> type:
+        """Return the class of the trees below the root of a prefix tree of
+        this class.
+        """
+        return CompressedPrefixNode
+
+    def isprefix(self, prefix: List) -> bool:
+        """Check whether self.value is the prefix of the 'prefix'"""
+        if self.is_leaf():
             return False
+        elif self._depth > len(prefix):
+            return False
+        else:
+            return all([self._value[i] == prefix[i] for i in
+                        range(self._depth)])
+
+    def next_subtree(self, prefix: List) -> Optional[CompressedPrefixNode]:
+        """Return the subtree of self whose value is a prefix of <prefix>, or
+        None if there is no such subtree.
 
-    def com_insert_case_8_helper(
-            self, value: Any, prefix: List, weight: float) -> None:
-        """Case 8
-        None of the subtree is the prefix of the 'prefix'.
-        No recursive call is made.
+        Precondition: self.value is a prefix of <prefix>.
         """
-        new_prefix = CompressedPrefixTree(self.weight_type)
-        new_prefix.assign(prefix, weight)
-        new_leaf = CompressedPrefixTree(self.weight_type)
-        new_leaf.assign(value, weight)
-        new_prefix.subtrees.append(new_leaf)
-        new_prefix.length += 1
-        self.subtrees.append(new_prefix)
-        self.length += 1
-        if self.weight_type == 'average':
-            self.weight = (self.weight * (self.length - 1) + weight) / \
-                          self.length
+        if self._depth < len(prefix):
+            subtree = self.find_subtree(prefix[self._depth])
+            if subtree is not None and subtree._depth <= len(prefix) and \
+                    subtree.agrees_with(prefix, self._depth + 1):
+                return subtree
+        return None
+
+    def insert_here(self, value: Any, weight: float, prefix: List,
+                    new: bool = False) -> CompressedPrefixNode:
+        """Insert <value> with <weight> and <prefix> into self, where no
+        subtree of self has a value that is a prefix of <prefix>, and return
+        the leaf of <value>. If <new> is True, <value> is known not to be in
+        self, so the leaves of self are not searched for it.
+
+        Unlike insert, this does not update the trees above self.
+        """
+        if self.is_empty():
+            self.assign_prefix(prefix, len(prefix))
+            self.weight = float(weight)
+            new_leaf = CompressedPrefixNode(self.weight_type)
+            new_leaf.assign(value, weight)
+            self.subtrees.append(new_leaf)
+            self.length = 1
+            self._total = float(weight)
+            self._max = float(weight)
+            self.refresh_top()
+            return new_leaf
+        common = self.common_length(prefix, 0)
+        if common < self._depth:
+            # Only the root can part ways with prefix, since insert only walks
+            # into subtrees whose values are prefixes of prefix.
+            self.split(common)
+            return self.add_value(value, weight, prefix)
+        elif self._depth == len(prefix):
+            for subtree in [] if new else self.subtrees:
+                if subtree.value == value:
+                    # The value is in the tree, so the length is unchanged.
+                    old_subtree_weight = subtree.weight
+                    subtree.weight = float(subtree.weight + weight)
+                    self.move_subtree(subtree, old_subtree_weight)
+                    self.adjust_weight(weight, subtree.weight)
+                    self.merge_top(subtree)
+                    return subtree
+            return self.add_value(value, weight, prefix)
         else:
-            self.weight = float(self.weight + weight)
-        self.subtrees = sorted(self.subtrees,
-                               key=lambda x: x.weight,
-                               reverse=True)
+            subtree = self.find_subtree(prefix[self._depth])
+            if subtree is None:
+                return self.add_value(value, weight, prefix)
+            # subtree shares the next items of prefix, but parts ways with it
+            # or goes on past its end, so it is split where they part.
+            old_subtree_weight = subtree.weight
+            subtree.split(subtree.common_length(prefix, self._depth + 1))
+            new_leaf = subtree.add_value(value, weight, prefix)
+            self.length = self.length + 1
+            self.move_subtree(subtree, old_subtree_weight)
+            self.adjust_weight(weight, new_leaf.weight)
+            self.merge_top(subtree)
+            return new_leaf
 
-    def com_insert_case_9_helper(
-            self, value: Any, prefix: List, weight: float, common_part: List) \
-            -> None:
-        """Case 9
-        In this case, self is not the prefix of prefix, so we do not need
-        to make a recursive call.
-        And, len(prefix) > len(self) and they share some
-        same parts according to the conditions of other cases.
-        """
-        temp_self = CompressedPrefixTree(self.weight_type)
-        temp_self.assign(self.value, self.weight)
-        temp_self.subtrees = self.subtrees
-        temp_self.length = self.length
-        new_prefix = CompressedPrefixTree(self.weight_type)
-        new_prefix.assign(prefix, weight)
-        new_leaf = CompressedPrefixTree(self.weight_type)
+    def split(self, depth: int) -> None:
+        """Move the contents of self into a new subtree of self, and shorten
+        self.value to its first <depth> items.
+
+        Precondition: self is not a leaf, and depth < len(self.value).
+        """
+        lower = CompressedPrefixNode(self.weight_type, self._top_k)
+        lower.assign_prefix(self._value, self._depth)
+        lower.weight = self.weight
+        lower.subtrees = self.subtrees
+        lower.length = self.length
+        lower._total = self._total
+        lower._max = self._max
+        lower._children = self._children
+        lower._top = self._top
+        self._depth = depth
+        self.subtrees = [lower]
+        self._children = None
+        self._top = None if lower._top is None else list(lower._top)
+
+    def add_value(self, value: Any, weight: float, prefix: List) \
+            -> CompressedPrefixNode:
+        """Add a leaf for <value> with <weight> and <prefix> to self, in a new
+        subtree with value <prefix> unless self.value is <prefix>, and return
+        the leaf.
+
+        Precondition: self.value is a prefix of <prefix>, and no subtree of
+        self shares the item that follows self.value in <prefix>.
+        """
+        new_leaf = CompressedPrefixNode(self.weight_type)
         new_leaf.assign(value, weight)
-        new_prefix.subtrees.append(new_leaf)
-        new_prefix.length += 1
-        self.value = common_part
-        if self.weight_type == 'average':
-            self.weight = (self.weight * self.length + weight) / \
-                          (self.length + 1)
+        if self._depth == len(prefix):
+            new_subtree = new_leaf
         else:
-            self.weight = float(self.weight + weight)
-        self.subtrees = [temp_self, new_prefix]
-        self.length += 1
-        self.subtrees = sorted(self.subtrees, key=lambda x: x.weight,
-                               reverse=True)
-
-    def get_common_part(self, prefix: List) -> List:
-        """Get the common part with prefix."""
-        common_part = []
-        for i in range(min(len(prefix), len(self.value))):
-            if prefix[i] == self.value[i]:
-                common_part.append(prefix[i])
-            else:
-                return common_part
-        return common_part
+            new_subtree = CompressedPrefixNode(self.weight_type, self._top_k)
+            new_subtree.assign_prefix(prefix, len(prefix))
+            new_subtree.weight = float(weight)
+            new_subtree.subtrees.append(new_leaf)
+            new_subtree.length = 1
+            new_subtree._total = float(weight)
+            new_subtree._max = float(weight)
+            new_subtree.refresh_top()
+        self.add_subtree(new_subtree)
+        self.index_subtree(new_subtree)
+        self.length = self.length + 1
+        self.adjust_weight(weight, new_leaf.weight)
+        self.merge_top(new_subtree)
+        return new_leaf
 
-    def search_prefix(self, prefix: List) -> tuple:
+    def search_prefix(self, prefix: List, start: int = 0) -> tuple:
         """Find which internal value we should end at.
         There are two possible cases:
         1. Stop when we find prefix == self.value, in other words, the prefix
          exists in the tree already.
         2. Stop when we find prefix doesn't contain all items in any
         subtree.value).
-        This function maybe called recursively, if we find one subtree.value
-        whose items are all in prefix.
-        """
-        if len(prefix) <= len(self.value) and \
-                all([prefix[i] == self.value[i] for i in range(len(prefix))]):
-            # In this case, prefix is the prefix of self, so we need to output
-            # every leaf in self.
-            return self, True
-        elif len(prefix) <= len(self.value):
-            return self, False
-        else:
-            # In this case, prefix is longer than self.value. That means,
-            #  perhaps it is the prefix of a subtree
-            # in self. If so, recursive call is needed. Otherwise,
-            #  no recursive call is needed.
-            for subtree in self.subtrees:
-                if len(prefix) <= len(subtree.value) \
-                        and all([prefix[i] == subtree.value[i]
-                                 for i in range(len(prefix))]):
-                    # prefix is the prefix of this subtree.
-                    return subtree.search_prefix(prefix)
-                elif len(prefix) > len(subtree.value) \
-                        and all([prefix[i] == subtree.value[i]
-                                 for i in range(len(subtree.value))]):
-                    # subtree is the prefix of the 'prefix'.
-                    return subtree.search_prefix(prefix)
-            return self, False
+        The search moves down one subtree at a time, as long as it finds a
+        subtree.value whose items are all in prefix.
 
-    def remove(self, prefix: List) -> None:
-        """Remove all values that match the given prefix.
+        Precondition: self.value and <prefix> have the same items before index
+        <start>.
         """
-        if not prefix:
-            self.subtrees = []
-            self.weight = 0.0
-            self.length = 0
-        elif len(self.value) >= len(prefix) and \
-                all([prefix[i] == self.value[i] for i in range(len(prefix))]):
-            # prefix is the prefix of self.
+        # Every tree on the way down already agrees with prefix on the items
+        # before <start>.
+        tree = self
+        while tree.agrees_with(prefix, start):
+            if len(prefix) <= tree._depth:
+                # In this case, prefix is the prefix of tree, so we need to
+                # output every leaf in tree.
+                return tree, True
+            # In this case, prefix is longer than tree.value. That means,
+            # perhaps it is the prefix of a subtree in tree.
+            subtree = tree.find_subtree(prefix[tree._depth])
+            if subtree is None:
+                return tree, False
+            start = tree._depth + 1
+            tree = subtree
+        return tree, False
+
+    def finish_removal(self, removed: set) -> None:
+        """Drop the subtrees of self whose ids are in <removed> or that have no
+        values left, then recompute the weight, length, subtree order, child
+        index and cached top leaves of self, for remove_many. If that leaves
+        self compressible, merge it with its only subtree.
+        """
+        SimplePrefixNode.finish_removal(self, removed)
+        if not self.subtrees:
             self.value = []
-            self.weight = 0.0
-            self.length = 0
-        else:
-            for subtree in self.subtrees:
-                if len(subtree.value) >= len(prefix) and \
-                        all([prefix[i] == subtree.value[i]
-                             for i in range(len(prefix))]) and \
-                        not subtree.is_leaf():
-                    old_subtree_weight = float(subtree.weight)
-                    old_subtree_length = len(subtree)
-                    old_length = self.length
-                    self.subtrees.remove(subtree)
-                    # subtree is removed.
-                    self.length = self.length - old_subtree_length
-                    if self.weight_type == 'average':
-                        self.weight = \
-                            (self.weight * old_length - old_subtree_weight
-                             * old_subtree_length) / self.length
-                    else:
-                        self.weight = float(self.weight -
-                                            old_subtree_weight)
-                        # need to check whether self is compressible?
-                    if len(self.subtrees) == 1 and \
-                            not self.subtrees[0].is_leaf():
-                        temp = self.subtrees[0]
-                        self.value = temp.value
-                        self.subtrees = temp.subtrees
-                        self.weight = temp.weight
-                        self.length = temp.length
-                    self.subtrees = sorted(self.subtrees,
-                                           key=lambda x: x.weight,
-                                           reverse=True)
-                    return
-                elif subtree.isprefix(prefix) and not subtree.is_leaf():
-                    old_length = self.length
-                    old_subtree_weight = subtree.weight
-                    old_subtree_length = subtree.length
-                    subtree.remove(prefix)
-                    self.length = self.length - (old_subtree_length -
-                                                 subtree.length)
-                    if self.weight_type == 'average':
-                        self.weight = (self.weight * old_length -
-                                       (old_subtree_weight * old_subtree_length
-                                        - subtree.weight * subtree.length)) / \
-                                      self.length
-                    else:
-                        self.weight = float(self.weight -
-                                            (old_subtree_weight -
-                                             subtree.weight))
-                        # need to check it!
-                    if len(subtree.subtrees) == 1 and \
-                            not subtree.subtrees[0].is_leaf():
-                        index = self.subtrees.index(subtree)
-                        self.subtrees[index] = subtree.subtrees[0]
-                    self.subtrees = sorted(self.subtrees,
-                                           key=lambda x: x.weight,
-                                           reverse=True)
-                    self.remove_empty_prefix()
+        self.remove_helper()
 
     def remove_helper(self) -> None:
         """If self is compressible, will compress it to its only child."""
         if len(self.subtrees) == 1 and \
                 not self.subtrees[0].is_leaf():
             temp = self.subtrees[0]
-            self.value = temp.value
+            self.assign_prefix(temp._value, temp._depth)
             self.subtrees = temp.subtrees
+            self._children = temp._children
+            self._top = temp._top
             self.weight = temp.weight
             self.length = temp.length
+            self._total = temp._total
+            self._max = temp._max
         else:
             return
 
 
+class CompressedPrefixTree(CompressedPrefixNode, SimplePrefixTree):
+    """A compressed prefix tree, as described in CompressedPrefixNode, whose
+    subtrees are CompressedPrefixNodes.
+
+    === Private Attributes ===
+    The same as those of SimplePrefixTree.
+    """
+    __slots__ = ()
+
+    def remove(self, prefix: List) -> None:
+        """Remove all values that match the given prefix.
+        """
+        self._version += 1
+        if not prefix or (self._depth >= len(prefix) and
+                          self.common_length(prefix, 0) == len(prefix)):
+            # prefix is the prefix of self.
+            if self._index is not None:
+                self._index.clear()
+            self.value = []
+            self.subtrees = []
+            self._children = None
+            self.weight = 0.0
+            self.length = 0
+            self._total = 0.0
+            self._max = 0.0
+        elif self.isprefix(prefix):
+            # Walk down while the subtree that prefix continues into has a
+            # value that is a prefix of prefix, remembering each subtree's
+            # weight before the removal so that its parent can be updated on
+            # the way back up.
+            path = []
+            tree = self
+            subtree = tree.find_subtree(prefix[tree._depth])
+            while subtree is not None and subtree._depth < len(prefix) and \
+                    subtree.agrees_with(prefix, tree._depth + 1):
+                path.append((tree, subtree, subtree.weight))
+                tree = subtree
+                subtree = tree.find_subtree(prefix[tree._depth])
+            removed_length = 0
+            removed_total = 0.0
+            removed_max = 0.0
+            if subtree is not None and \
+                    subtree.agrees_with(prefix, tree._depth + 1):
+                # prefix is the prefix of subtree, which every tree on the
+                # path loses.
+                removed_length = subtree.length
+                removed_total = subtree.leaf_total()
+                removed_max = subtree.leaf_max()
+                tree.drop_subtree(subtree, subtree.weight)
+                self.forget_values([subtree])
+                tree.length = tree.length - removed_length
+                tree.lose_weight(removed_total, removed_max)
+                # need to check whether tree is compressible?
+                tree.remove_helper()
+                tree.refresh_top()
+            for parent, subtree, old_subtree_weight in reversed(path):
+                parent.length = parent.length - removed_length
+                if len(subtree.subtrees) == 1 and \
+                        not subtree.subtrees[0].is_leaf():
+                    index = parent.locate_subtree(subtree, old_subtree_weight)
+                    parent.subtrees[index] = subtree.subtrees[0]
+                    parent.index_subtree(subtree.subtrees[0])
+                    subtree = subtree.subtrees[0]
+                parent.move_subtree(subtree, old_subtree_weight)
+                parent.lose_weight(removed_total, removed_max)
+                parent.refresh_top()
+            # Every tree that changed is on the path, and none of them has
+            # been left empty, so there is nothing else to clean up.
+        self.refresh_top()
+
+    def remove_many(self, prefixes: List[List]) -> None:
+        """Remove all values that match any of the given prefixes.
+
+        See SimplePrefixTree.remove_many.
+        """
+        for prefix in prefixes:
+            if len(prefix) <= self._depth and \
+                    self.common_length(prefix, 0) == len(prefix):
+                # prefix matches every value in self.
+                self.remove(prefix)
+                return
+        SimplePrefixTree.remove_many(
+            self, [prefix for prefix in prefixes if self.isprefix(prefix)])
+
+    @classmethod
+    def from_items(cls, weight_type: str,
+                   items: Iterable[Tuple[Any, float, List]],
+                   top_k: Optional[int] = None) -> CompressedPrefixTree:
+        """Return a new compressed prefix tree with the given <weight_type>
+        and <top_k> that holds the (value, weight, prefix) triples in <items>.
+
+        See SimplePrefixTree.from_items.
+        """
+        tree = cls.build(weight_type, items, top_k, True)
+        tree.remove_helper()
+        return tree
+
+
+################################################################################
+# ConcurrentAutocompleter
+################################################################################
+class ConcurrentAutocompleter(Autocompleter):
+    """An Autocompleter over a SimplePrefixTree or CompressedPrefixTree that
+    any number of threads can query, without locking, while other threads
+    change it.
+
+    Queries read the tree that was published last, which is never changed
+    again. A change copies the trees on the path it changes, which share
+    every other subtree with the published tree, makes the change to the
+    copies and then publishes the copied root in a single assignment. Changes
+    are made one at a time.
+
+    === Private Attributes ===
+    _root: The tree that was published last.
+    _write_lock: The lock that changes hold while they are made.
+    """
+    _root: SimplePrefixTree
+    _write_lock: threading.Lock
+
+    __slots__ = ('_root', '_write_lock')
+
+    def __init__(self, tree: SimplePrefixTree) -> None:
+        """Initialize an Autocompleter that publishes <tree>.
+
+        <tree> must not be changed other than through this Autocompleter.
+        """
+        self._root = tree
+        self._write_lock = threading.Lock()
+
+    def snapshot(self) -> SimplePrefixTree:
+        """Return the tree that was published last. It must not be changed.
+        """
+        return self._root
+
+    def __len__(self) -> int:
+        """Return the number of values stored in this Autocompleter."""
+        return len(self._root)
+
+    def insert(self, value: Any, weight: float, prefix: List) -> None:
+        """Insert the given value into this Autocompleter.
+
+        The value is inserted with the given weight, and is associated with
+        the prefix sequence <prefix>.
+
+        If the value has already been inserted into this prefix tree
+        (compare values using ==), then the given weight should be *added* to
+        the existing weight of this value.
+
+        Preconditions:
+            weight > 0
+            The given value is either:
+                1) not in this Autocompleter
+                2) was previously inserted with the SAME prefix sequence
+        """
+        with self._write_lock:
+            path = self.copy_path(prefix)
+            tree = path[-1]
+            # The leaf of <value>, if it is already in the tree, is given a
+            # new weight, so it is copied as well.
+            for leaf in tree.subtrees:
+                if leaf.is_leaf() and leaf.value == value:
+                    new_leaf = leaf.copy_node()
+                    tree.replace_subtree(leaf, new_leaf)
+                    for parent in path[:-1]:
+                        parent.replace_top(leaf, new_leaf)
+                    break
+            path[0].insert(value, weight, prefix)
+            self._root = path[0]
+
+    def autocomplete(self, prefix: List,
+                     limit: Optional[int] = None) -> List[Tuple[Any, float]]:
+        """Return up to <limit> matches for the given prefix.
+
+        The return value is a list of tuples (value, weight), and must be
+        ordered in non-increasing weight. (You can decide how to break ties.)
+
+        If limit is None, return *every* match for the given prefix.
+
+        Precondition: limit is None or limit > 0.
+        """
+        return self._root.autocomplete(prefix, limit)
+
+    def autocomplete_many(self, prefixes: List[List],
+                          limit: Optional[int] = None) \
+            -> List[List[Tuple[Any, float]]]:
+        """Return the result of self.autocomplete(prefix, limit) for each
+        prefix in <prefixes>, in the same order as <prefixes>.
+
+        Every prefix is answered from the same published tree.
+
+        Precondition: limit is None or limit > 0.
+        """
+        return self._root.autocomplete_many(prefixes, limit)
+
+    def remove(self, prefix: List) -> None:
+        """Remove all values that match the given prefix.
+        """
+        with self._write_lock:
+            root = self.copy_path(prefix)[0]
+            root.remove(prefix)
+            self._root = root
+
+    def copy_path(self, prefix: List) -> List[SimplePrefixNode]:
+        """Return copies of the published root and of every tree below it
+        that an insert or remove with <prefix> walks down through, in order
+        from the root. Each copy is in the place of the tree it copies in the
+        copy of its parent.
+
+        The subtree of the last of these that shares the next item of
+        <prefix>, which a compressed tree's insert splits, is copied too.
+        """
+        tree = self._root.copy_node()
+        path = [tree]
+        if not tree.isprefix(prefix):
+            return path
+        subtree = tree.next_subtree(prefix)
+        while subtree is not None:
+            new_subtree = subtree.copy_node()
+            tree.replace_subtree(subtree, new_subtree)
+            path.append(new_subtree)
+            tree = new_subtree
+            subtree = tree.next_subtree(prefix)
+        if tree._depth < len(prefix):
+            subtree = tree.find_subtree(prefix[tree._depth])
+            if subtree is not None:
+                tree.replace_subtree(subtree, subtree.copy_node())
+        return path
+
+
+################################################################################
+# DecayingAutocompleter
+################################################################################
+class DecayingAutocompleter(Autocompleter):
+    """An Autocompleter over a SimplePrefixTree or CompressedPrefixTree whose
+    weights decay exponentially with time, halving every half-life.
+
+    Decaying every weight as time passes would change every tree, so weights
+    are stored relative to an epoch instead: a weight w inserted t seconds
+    after the epoch is stored as w * 2 ** (t / half_life), and a stored
+    weight s is worth s / 2 ** (t / half_life) t seconds after the epoch.
+    Every stored weight decays by the same factor, so time passing leaves
+    the order of the weights, and the tree, unchanged. Once stored weights
+    would grow by more than DECAY_RESCALE_FACTOR, the next insert rescales
+    the tree to a new epoch in one pass, before the factor they would grow
+    by is computed. Queries never change the tree, so they can run at the
+    same time as each other.
+
+    === Attributes ===
+    half_life:
+        The number of seconds it takes a weight to halve.
+
+    === Private Attributes ===
+    _tree: The tree that holds the stored weights.
+    _clock: The function that returns the current time, in seconds.
+    _epoch: The time at which stored weights are the weights themselves.
+    """
+    half_life: float
+    _tree: SimplePrefixTree
+    _clock: Callable[[], float]
+    _epoch: float
+
+    __slots__ = ('half_life', '_tree', '_clock', '_epoch')
+
+    def __init__(self, tree: SimplePrefixTree, half_life: float,
+                 clock: Callable[[], float] = time.monotonic) -> None:
+        """Initialize an Autocompleter over <tree>, whose weights are taken
+        to be the weights at the current time.
+
+        <tree> must not be changed other than through this Autocompleter.
+
+        Precondition: half_life > 0.
+        """
+        self.half_life = half_life
+        self._tree = tree
+        self._clock = clock
+        self._epoch = clock()
+
+    def scale(self) -> float:
+        """Return the factor that turns a weight at the current time into a
+        stored weight, first rescaling the tree to a new epoch if the factor
+        is more than DECAY_RESCALE_FACTOR.
+
+        This changes the tree, so only insert calls it.
+        """
+        now = self._clock()
+        exponent = (now - self._epoch) / self.half_life
+        if exponent > math.log2(DECAY_RESCALE_FACTOR):
+            # After a long enough idle spell, 2.0 ** exponent overflows, so
+            # the tree is rescaled without computing it.
+            self.rescale(now, exponent)
+            return 1.0
+        return 2.0 ** exponent
+
+    def decay(self) -> float:
+        """Return the factor that turns a stored weight into a weight at the
+        current time.
+
+        Unlike scale, this never changes the tree, so queries that run at
+        the same time can all call it. The factor underflows to 0 rather
+        than overflowing after a long idle spell.
+        """
+        return 2.0 ** (-(self._clock() - self._epoch) / self.half_life)
+
+    def rescale(self, now: float, exponent: float) -> None:
+        """Move the epoch to <now>, <exponent> half-lives after the current
+        epoch, dividing every stored weight by 2 ** <exponent>.
+
+        A stored weight small enough to underflow is kept at
+        sys.float_info.min by SimplePrefixTree.scale_weights.
+        """
+        self._tree.scale_weights(2.0 ** -exponent)
+        self._epoch = now
+
+    def __len__(self) -> int:
+        """Return the number of values stored in this Autocompleter."""
+        return len(self._tree)
+
+    def insert(self, value: Any, weight: float, prefix: List) -> None:
+        """Insert the given value into this Autocompleter.
+
+        The value is inserted with the given weight, and is associated with
+        the prefix sequence <prefix>.
+
+        If the value has already been inserted into this prefix tree
+        (compare values using ==), then the given weight should be *added* to
+        the existing weight of this value, as it has decayed so far.
+
+        Preconditions:
+            weight > 0
+            The given value is either:
+                1) not in this Autocompleter
+                2) was previously inserted with the SAME prefix sequence
+        """
+        self._tree.insert(value, weight * self.scale(), prefix)
+
+    def autocomplete(self, prefix: List,
+                     limit: Optional[int] = None) -> List[Tuple[Any, float]]:
+        """Return up to <limit> matches for the given prefix, with their
+        weights as they have decayed by now.
+
+        The return value is a list of tuples (value, weight), and must be
+        ordered in non-increasing weight. (You can decide how to break ties.)
+
+        If limit is None, return *every* match for the given prefix.
+
+        Precondition: limit is None or limit > 0.
+        """
+        decay = self.decay()
+        return [(value, weight * decay)
+                for value, weight in self._tree.autocomplete(prefix, limit)]
+
+    def autocomplete_many(self, prefixes: List[List],
+                          limit: Optional[int] = None) \
+            -> List[List[Tuple[Any, float]]]:
+        """Return the result of self.autocomplete(prefix, limit) for each
+        prefix in <prefixes>, in the same order as <prefixes>.
+
+        Every weight is decayed to the same moment.
+
+        Precondition: limit is None or limit > 0.
+        """
+        decay = self.decay()
+        return [[(value, weight * decay) for value, weight in results]
+                for results in self._tree.autocomplete_many(prefixes, limit)]
+
+    def remove(self, prefix: List) -> None:
+        """Remove all values that match the given prefix.
+        """
+        self._tree.remove(prefix)
+
+    def remove_many(self, prefixes: List[List]) -> None:
+        """Remove all values that match any of the given prefixes."""
+        self._tree.remove_many(prefixes)
+
+
+################################################################################
+# MappedPrefixTree
+################################################################################
+class MappedPrefixTree(Autocompleter):
+    """A read-only prefix tree that answers queries straight from a snapshot
+    written by SimplePrefixTree.save (or CompressedPrefixTree.save).
+
+    Loading a snapshot with MappedPrefixTree.load memory-maps the file, so no
+    tree objects are created, and processes that load the same file share its
+    pages. Only the values returned by autocomplete are unpickled.
+
+    Snapshots hold pickled data, so only load snapshots you trust.
+
+    A snapshot is made up of:
+        - a header, with the number of trees and where each part starts
+        - one record per tree, in breadth-first order: its weight, its number
+          of leaves, the number of its first subtree and its number of
+          subtrees, where its label starts in the labels and the label's
+          length, and where its lookup pairs start in the lookups and how many
+          there are. For a leaf, the label start is the number of its value.
+        - the labels: the ids of the prefix items that each tree's value adds
+          to its parent's value
+        - the lookups: for each tree, (item id, tree number) pairs for its
+          non-leaf subtrees, sorted by the id of the first item of their label
+        - the offsets of the values, then the pickled values themselves
+        - the pickled weight type and list of prefix items (an item's id is
+          its index in the list)
+
+    === Attributes ===
+    weight_type: A str records what kind of aggregate weight it is.
+
+    === Private Attributes ===
+    _buffer:
+        The snapshot, usually a read-only memory map of its file.
+    _elements:
+        A dictionary mapping each prefix item in the snapshot to its id.
+    _labels_start, _lookups_start, _offsets_start, _values_start:
+        Where the labels, lookups, value offsets and values start in _buffer.
+    """
+    weight_type: str
+    _buffer: Any
+    _elements: Dict[Any, int]
+    _labels_start: int
+    _lookups_start: int
+    _offsets_start: int
+    _values_start: int
+
+    __slots__ = ('weight_type', '_buffer', '_elements', '_labels_start',
+                 '_lookups_start', '_offsets_start', '_values_start')
+
+    def __init__(self, buffer: Any) -> None:
+        """Initialize a prefix tree that reads the snapshot in <buffer>, a
+        bytes-like object.
+        """
+        magic, _, self._labels_start, self._lookups_start, \
+            self._offsets_start, self._values_start, meta_start = \
+            _HEADER.unpack_from(buffer, 0)
+        if magic != SNAPSHOT_MAGIC:
+            raise ValueError('not a prefix tree snapshot')
+        self._buffer = buffer
+        self.weight_type, elements = pickle.loads(buffer[meta_start:])
+        self._elements = {}
+        for i in range(len(elements)):
+            self._elements[elements[i]] = i
+
+    @classmethod
+    def load(cls, path: str) -> MappedPrefixTree:
+        """Return a prefix tree that reads the snapshot in the file <path>
+        through a read-only memory map.
+        """
+        with open(path, 'rb') as f:
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return cls(buffer)
+
+    def __len__(self) -> int:
+        """Return the number of values stored in this Autocompleter."""
+        weight, length, _, child_count, _, _, _, _ = self.record(0)
+        if child_count == 0 and weight > 0:
+            return 1
+        return length
+
+    def insert(self, value: Any, weight: float, prefix: List) -> None:
+        """Raise NotImplementedError: a MappedPrefixTree is read-only."""
+        raise NotImplementedError('a MappedPrefixTree is read-only')
+
+    def remove(self, prefix: List) -> None:
+        """Raise NotImplementedError: a MappedPrefixTree is read-only."""
+        raise NotImplementedError('a MappedPrefixTree is read-only')
+
+    def autocomplete(self, prefix: List,
+                     limit: Optional[int] = None) -> List[Tuple[Any, float]]:
+        """Return up to <limit> matches for the given prefix.
+
+        The return value is a list of tuples (value, weight), and must be
+        ordered in non-increasing weight. (You can decide how to break ties.)
+
+        If limit is None, return *every* match for the given prefix.
+
+        Precondition: limit is None or limit > 0.
+        """
+        node = self.search_prefix(prefix)
+        if node is None:
+            return []
+        _, _, first_child, child_count, _, _, _, _ = self.record(node)
+        if child_count == 0:
+            return []
+        elif not AGGREGATORS[self.weight_type].bounds_leaves:
+            return self.collect_leaves(node, limit)
+        # As in SimplePrefixTree.autocomplete_helper, siblings are sorted, so
+        # a tree's next sibling enters the heap when the tree is popped.
+        accumulator = []
+        count = 0
+        heap = [(-self.record(first_child)[0], count, first_child,
+                 first_child + child_count)]
+        while heap and (limit is None or len(accumulator) < limit):
+            _, _, node, end = heapq.heappop(heap)
+            if node + 1 < end:
+                count += 1
+                heapq.heappush(heap, (-self.record(node + 1)[0], count,
+                                      node + 1, end))
+            weight, _, first_child, child_count, label_start, _, _, _ = \
+                self.record(node)
+            if child_count == 0:
+                accumulator.append((self.value_at(label_start), weight))
+            else:
+                count += 1
+                heapq.heappush(heap, (-self.record(first_child)[0], count,
+                                      first_child, first_child + child_count))
+        return accumulator
+
+    def collect_leaves(self, node: int, limit: Optional[int] = None) \
+            -> List[Tuple[Any, float]]:
+        """Return the <limit> heaviest leaves below tree number <node>, found
+        by visiting every leaf. Used when aggregate weights do not bound leaf
+        weights.
+        """
+        leaves = []
+        stack = [node]
+        while stack:
+            weight, _, first_child, child_count, label_start, _, _, _ = \
+                self.record(stack.pop())
+            if child_count == 0:
+                leaves.append((label_start, weight))
+            else:
+                stack.extend(range(first_child, first_child + child_count))
+        if limit is None:
+            leaves = sorted(leaves, key=lambda x: x[1], reverse=True)
+        else:
+            leaves = heapq.nlargest(limit, leaves, key=lambda x: x[1])
+        return [(self.value_at(value), weight) for value, weight in leaves]
+
+    def search_prefix(self, prefix: List) -> Optional[int]:
+        """Return the number of the tree where the matches for <prefix> are,
+        or None if nothing matches <prefix>.
+        """
+        node = 0
+        matched = 0
+        while True:
+            _, _, _, _, label_start, label_length, lookup_start, \
+                lookup_count = self.record(node)
+            for i in range(min(label_length, len(prefix) - matched)):
+                if self._elements.get(prefix[matched + i]) != \
+                        self.label(label_start + i):
+                    return None
+            if len(prefix) - matched <= label_length:
+                return node
+            matched += label_length
+            node = self.find_subtree(lookup_start, lookup_count,
+                                     self._elements.get(prefix[matched]))
+            if node is None:
+                return None
+
+    def find_subtree(self, lookup_start: int, lookup_count: int,
+                     element_id: Optional[int]) -> Optional[int]:
+        """Return the number of the subtree listed in the <lookup_count>
+        lookup pairs from <lookup_start> whose label starts with <element_id>,
+        or None if there is no such subtree.
+        """
+        if element_id is None:
+            return None
+        start, end = lookup_start, lookup_start + lookup_count
+        while start < end:
+            mid = (start + end) // 2
+            mid_id = self.lookup(2 * mid)
+            if mid_id == element_id:
+                return self.lookup(2 * mid + 1)
+            elif mid_id < element_id:
+                start = mid + 1
+            else:
+                end = mid
+        return None
+
+    def record(self, node: int) -> Tuple[float, int, int, int, int, int, int,
+                                         int]:
+        """Return the record of tree number <node>."""
+        return _NODE.unpack_from(self._buffer,
+                                 _HEADER.size + _NODE.size * node)
+
+    def label(self, index: int) -> int:
+        """Return the item id at <index> in the labels."""
+        return _U32.unpack_from(self._buffer,
+                                self._labels_start + _U32.size * index)[0]
+
+    def lookup(self, index: int) -> int:
+        """Return the number at <index> in the lookups."""
+        return _U32.unpack_from(self._buffer,
+                                self._lookups_start + _U32.size * index)[0]
+
+    def value_at(self, index: int) -> Any:
+        """Return value number <index>."""
+        start, end = struct.unpack_from(
+            '<2Q', self._buffer, self._offsets_start + _U64.size * index)
+        return pickle.loads(self._buffer[self._values_start + start:
+                                         self._values_start + end])
+
+
+################################################################################
+# ShardedAutocompleter
+################################################################################
+def shard_index(prefix: List, key_length: int, shard_count: int) -> int:
+    """Return the number of the shard that owns the values with <prefix>,
+    out of <shard_count> shards keyed on the first <key_length> elements of a
+    prefix.
+
+    The shard only depends on the repr of those elements, so it is the same
+    in every process and every run.
+    """
+    key = repr(tuple(prefix[:key_length])).encode('utf8')
+    return zlib.crc32(key) % shard_count
+
+
+class ShardedAutocompleter(Autocompleter):
+    """An Autocompleter that splits its values across several Autocompleters,
+    its shards, by the first elements of their prefixes.
+
+    Every value whose prefix starts with the same <key_length> elements (or
+    that has the same prefix, for prefixes shorter than that) is in the same
+    shard. An autocomplete for a prefix of at least <key_length> elements only
+    asks that prefix's shard; a shorter prefix asks every shard and merges
+    their results.
+
+    === Attributes ===
+    shards: The Autocompleters that hold the values.
+
+    === Private Attributes ===
+    _key_length:
+        The number of leading prefix elements that pick a value's shard.
+
+    === Representation invariants ===
+    - Every value with prefix p is in
+      self.shards[shard_index(p, self._key_length, len(self.shards))].
+    """
+    shards: List[Autocompleter]
+    _key_length: int
+
+    __slots__ = ('shards', '_key_length')
+
+    def __init__(self, shards: List[Autocompleter],
+                 key_length: int = 1) -> None:
+        """Initialize an Autocompleter made of <shards>, keyed on the first
+        <key_length> elements of a prefix.
+
+        Preconditions:
+            len(shards) > 0 and key_length > 0
+            every value in shards already satisfies the representation
+            invariant (e.g. every shard is empty)
+        """
+        self.shards = shards
+        self._key_length = key_length
+
+    @classmethod
+    def from_items(cls, tree_class: type, weight_type: str,
+                   items: Iterable[Tuple[Any, float, List]], shard_count: int,
+                   key_length: int = 1, top_k: Optional[int] = None) \
+            -> ShardedAutocompleter:
+        """Return a new ShardedAutocompleter with <shard_count> shards of
+        <tree_class> (SimplePrefixTree or CompressedPrefixTree) that holds the
+        (value, weight, prefix) triples in <items>.
+
+        Each shard is bulk-built with <tree_class>.from_items.
+        """
+        parts = [[] for _ in range(shard_count)]
+        for item in items:
+            parts[shard_index(item[2], key_length, shard_count)].append(item)
+        return cls([tree_class.from_items(weight_type, part, top_k)
+                    for part in parts], key_length)
+
+    def shard_for(self, prefix: List) -> Autocompleter:
+        """Return the shard that owns the values with <prefix>."""
+        return self.shards[shard_index(prefix, self._key_length,
+                                       len(self.shards))]
+
+    def __len__(self) -> int:
+        """Return the number of values stored in this Autocompleter."""
+        return sum(len(shard) for shard in self.shards)
+
+    def insert(self, value: Any, weight: float, prefix: List) -> None:
+        """Insert the given value into this Autocompleter.
+
+        The value is inserted with the given weight, and is associated with
+        the prefix sequence <prefix>.
+
+        If the value has already been inserted into this prefix tree
+        (compare values using ==), then the given weight should be *added* to
+        the existing weight of this value.
+
+        Preconditions:
+            weight > 0
+            The given value is either:
+                1) not in this Autocompleter
+                2) was previously inserted with the SAME prefix sequence
+        """
+        self.shard_for(prefix).insert(value, weight, prefix)
+
+    def autocomplete(self, prefix: List,
+                     limit: Optional[int] = None) -> List[Tuple[Any, float]]:
+        """Return up to <limit> matches for the given prefix.
+
+        The return value is a list of tuples (value, weight), and must be
+        ordered in non-increasing weight. (You can decide how to break ties.)
+
+        If limit is None, return *every* match for the given prefix.
+
+        Precondition: limit is None or limit > 0.
+        """
+        if len(prefix) >= self._key_length:
+            return self.shard_for(prefix).autocomplete(prefix, limit)
+        # Each shard's matches are sorted, so a k-way merge of the shards'
+        # top <limit> matches gives the overall top <limit>.
+        merged = heapq.merge(*[shard.autocomplete(prefix, limit)
+                               for shard in self.shards],
+                             key=lambda x: x[1], reverse=True)
+        return list(itertools.islice(merged, limit))
+
+    def autocomplete_many(self, prefixes: List[List],
+                          limit: Optional[int] = None) \
+            -> List[List[Tuple[Any, float]]]:
+        """Return the result of self.autocomplete(prefix, limit) for each
+        prefix in <prefixes>, in the same order as <prefixes>.
+
+        The prefixes owned by one shard are passed to it as a single batch.
+
+        Precondition: limit is None or limit > 0.
+        """
+        results = [None] * len(prefixes)
+        batches = {}
+        for i, prefix in enumerate(prefixes):
+            if len(prefix) >= self._key_length:
+                number = shard_index(prefix, self._key_length,
+                                     len(self.shards))
+                batches.setdefault(number, []).append(i)
+            else:
+                results[i] = self.autocomplete(prefix, limit)
+        for number, batch in batches.items():
+            answers = self.shards[number].autocomplete_many(
+                [prefixes[i] for i in batch], limit)
+            for i, answer in zip(batch, answers):
+                results[i] = answer
+        return results
+
+    def remove(self, prefix: List) -> None:
+        """Remove all values that match the given prefix.
+        """
+        if len(prefix) >= self._key_length:
+            self.shard_for(prefix).remove(prefix)
+        else:
+            for shard in self.shards:
+                shard.remove(prefix)
+
+    def remove_many(self, prefixes: List[List]) -> None:
+        """Remove all values that match any of the given prefixes.
+
+        Each shard is passed the prefixes that it owns, and every prefix
+        shorter than the key, as a single batch.
+        """
+        batches = [[] for _ in self.shards]
+        for prefix in prefixes:
+            if len(prefix) >= self._key_length:
+                batches[shard_index(prefix, self._key_length,
+                                    len(self.shards))].append(prefix)
+            else:
+                for batch in batches:
+                    batch.append(prefix)
+        for shard, batch in zip(self.shards, batches):
+            if batch:
+                shard.remove_many(batch)
+
+
 if __name__ == '__main__':
     import python_ta
     python_ta.check_all(config={
@@ -0,0 +1,137 @@
+"""CSC148 Assignment 2: Tests for autocomplete_engines.py
+
+=== Module Description ===
+This file contains tests for the query cache of the autocomplete engines in
+autocomplete_engines.py. Run it with pytest.
+"""
+from __future__ import annotations
+from typing import Any, Callable, List, Optional, Tuple
+
+import pytest
+
+from autocomplete_engines import LetterAutocompleteEngine, QueryCache
+
+
+def _counting(calls: List[Tuple[tuple, Optional[int]]]) \
+        -> Callable[[List, Optional[int]], List[Tuple[Any, float]]]:
+    """Return an autocomplete function that records each (prefix, limit) it
+    is called with in <calls>, and matches one value named after the prefix.
+    """
+    def autocomplete(prefix: List, limit: Optional[int]) \
+            -> List[Tuple[Any, float]]:
+        calls.append((tuple(prefix), limit))
+        return [(''.join(prefix), 1.0)]
+    return autocomplete
+
+
+def _fill(cache: QueryCache, prefixes: List[str]) -> None:
+    """Cache an entry for each prefix in <prefixes>, with no limit."""
+    for prefix in prefixes:
+        cache.fetch(list(prefix), None, _counting([]))
+
+
+def _cached(cache: QueryCache, prefixes: List[str]) -> List[str]:
+    """Return the prefixes in <prefixes> that <cache> answers without calling
+    autocomplete.
+    """
+    calls = []
+    for prefix in prefixes:
+        cache.fetch(list(prefix), None, _counting(calls))
+    missed = {''.join(prefix) for prefix, _ in calls}
+    return [prefix for prefix in prefixes if prefix not in missed]
+
+
+def test_fetch_caches_results() -> None:
+    """Test that a query is answered from the cache the second time, for the
+    same limit only, and that the least recently used entry is evicted.
+    """
+    cache = QueryCache(2)
+    calls = []
+    assert cache.fetch(['a'], 1, _counting(calls)) == [('a', 1.0)]
+    assert cache.fetch(['a'], 1, _counting(calls)) == [('a', 1.0)]
+    assert calls == [(('a',), 1)]
+    cache.fetch(['a'], None, _counting(calls))
+    assert (cache.hits, cache.misses) == (1, 2)
+    cache.fetch(['a'], 1, _counting(calls))
+    cache.fetch(['b'], 1, _counting(calls))
+    assert len(cache) == 2
+    assert cache.evictions == 1
+    cache.fetch(['a'], 1, _counting(calls))
+    assert calls[-1] == (('b',), 1)
+
+
+def test_invalidate_path() -> None:
+    """Test that inserting a value drops exactly the entries whose prefix is
+    a prefix of the value's prefix.
+    """
+    cache = QueryCache(100)
+    prefixes = ['', 'a', 'ab', 'abc', 'ac', 'b']
+    _fill(cache, prefixes)
+    cache.invalidate_path(list('ab'))
+    assert _cached(cache, prefixes) == ['abc', 'ac', 'b']
+
+
+def test_invalidate_under() -> None:
+    """Test that removing a prefix drops exactly the entries whose prefix is
+    a prefix of it or starts with it.
+    """
+    cache = QueryCache(100)
+    prefixes = ['', 'a', 'ab', 'abc', 'ac', 'b']
+    _fill(cache, prefixes)
+    cache.invalidate_under(list('ab'))
+    assert _cached(cache, prefixes) == ['ac', 'b']
+
+
+@pytest.mark.parametrize('autocompleter', ['simple', 'compressed'])
+def test_engine_cache_follows_changes(autocompleter: str,
+                                      tmp_path: Any) -> None:
+    """Test that an engine with a cache never answers from an entry that an
+    insert or remove has made out of date.
+    """
+    path = tmp_path / 'words.txt'
+    path.write_text('cat\ncar\ncar\ndog\n', encoding='utf8')
+    engine = LetterAutocompleteEngine({
+        'file': str(path),
+        'autocompleter': autocompleter,
+        'weight_type': 'sum',
+        'cache_entries': 10
+    })
+    assert engine.autocomplete('ca') == [('car', 2.0), ('cat', 1.0)]
+    assert engine.autocomplete('d') == [('dog', 1.0)]
+    engine.insert('cab', 3.0)
+    assert engine.autocomplete('ca') == [('cab', 3.0), ('car', 2.0),
+                                         ('cat', 1.0)]
+    hits = engine.cache.hits
+    assert engine.autocomplete('d') == [('dog', 1.0)]
+    assert engine.cache.hits == hits + 1
+    engine.remove('car')
+    assert engine.autocomplete('ca') == [('cab', 3.0), ('cat', 1.0)]
+    engine.remove_many(['ca', 'd'])
+    assert engine.autocomplete('') == []
+
+
+def test_letter_lines_filtered_before_lowercase(tmp_path: Any) -> None:
+    """Test that the lines of a LetterAutocompleteEngine's file, and strings
+    inserted later, keep their alphanumeric characters and spaces before
+    being put in lowercase, while queries are put in lowercase first.
+    """
+    path = tmp_path / 'words.txt'
+    path.write_text('\u0130stanbul!\n', encoding='utf8')
+    engine = LetterAutocompleteEngine({
+        'file': str(path),
+        'autocompleter': 'simple',
+        'weight_type': 'sum'
+    })
+    # '\u0130' (capital I with a dot) is alphanumeric, but its lowercase form
+    # ends in a combining dot that is not.
+    stored = '\u0130stanbul'.lower()
+    assert len(stored) == 9
+    assert engine.autocomplete('i') == [(stored, 1.0)]
+    assert engine.autocomplete('is') == []
+    engine.insert('\u0130zmir', 2.0)
+    assert engine.autocomplete('i') == [('\u0130zmir'.lower(), 2.0),
+                                        (stored, 1.0)]
+
+
+if __name__ == '__main__':
+    pytest.main(['test_autocomplete_engines.py'])
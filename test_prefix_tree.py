@@ -0,0 +1,444 @@
+"""CSC148 Assignment 2: Tests for prefix_tree.py
+
+=== Module Description ===
+This file contains tests for the prefix trees in prefix_tree.py. Run it with
+pytest.
+"""
+from __future__ import annotations
+import random
+import sys
+import threading
+from typing import Any, List, Optional, Tuple
+
+import pytest
+
+from prefix_tree import CompressedPrefixTree, ConcurrentAutocompleter, \
+    DecayingAutocompleter, MappedPrefixTree, ShardedAutocompleter, \
+    SimplePrefixTree, shard_index
+
+# The length of the prefix used to check that no tree operation recurses
+# once per prefix element.
+LONG_PREFIX_LENGTH = 100000
+
+
+def _count_leaves(tree: SimplePrefixTree) -> int:
+    """Return the number of leaves in <tree>, found by visiting all of them.
+    """
+    count = 0
+    stack = [tree]
+    while stack:
+        tree = stack.pop()
+        if tree.is_leaf():
+            count += 1
+        else:
+            stack.extend(tree.subtrees)
+    return count
+
+
+def _check_lengths(tree: SimplePrefixTree) -> None:
+    """Check that len() of <tree> and of every tree in it matches the number
+    of leaves below it.
+    """
+    stack = [tree]
+    while stack:
+        subtree = stack.pop()
+        assert len(subtree) == _count_leaves(subtree)
+        stack.extend(subtree.subtrees)
+
+
+def _random_items(seed: int, count: int) -> List[Tuple[str, float, List]]:
+    """Return <count> (value, weight, prefix) triples drawn with <seed>.
+
+    Every value has its own weight, so that the order of the matches for any
+    prefix does not depend on how ties are broken.
+    """
+    rng = random.Random(seed)
+    weights = list(range(1, count + 1))
+    rng.shuffle(weights)
+    items = []
+    for i in range(count):
+        prefix = [rng.choice('abc') for _ in range(rng.randint(0, 4))]
+        items.append((''.join(prefix) + str(i), float(weights[i]), prefix))
+    return items
+
+
+def _query_prefixes() -> List[List]:
+    """Return every prefix of up to 3 elements drawn from 'abcd'."""
+    prefixes = [[]]
+    for prefix in prefixes:
+        if len(prefix) < 3:
+            prefixes.extend(prefix + [element] for element in 'abcd')
+    return prefixes
+
+
+@pytest.mark.parametrize('tree_class', [SimplePrefixTree,
+                                        CompressedPrefixTree])
+def test_long_prefix(tree_class: type) -> None:
+    """Test inserting, searching, autocompleting and removing values whose
+    prefixes are far longer than the recursion limit allows a recursive walk
+    to go.
+    """
+    assert sys.getrecursionlimit() < LONG_PREFIX_LENGTH
+    prefix = list(range(LONG_PREFIX_LENGTH))
+    half = prefix[:LONG_PREFIX_LENGTH // 2]
+    tree = tree_class('sum')
+    tree.insert('long', 2.0, prefix)
+    tree.insert('half', 1.0, half)
+    tree.insert('other', 3.0, [1])
+    assert len(tree) == 3
+
+    stop_point, prefix_is_in = tree.search_prefix(prefix)
+    assert prefix_is_in
+    assert stop_point.value == prefix
+    assert tree.autocomplete(prefix) == [('long', 2.0)]
+    assert tree.autocomplete(half) == [('long', 2.0), ('half', 1.0)]
+    assert tree.autocomplete(prefix[:10], 1) == [('long', 2.0)]
+    assert tree.autocomplete(prefix + [-1]) == []
+
+    tree.remove(prefix[:LONG_PREFIX_LENGTH // 2 + 1])
+    assert len(tree) == 2
+    assert tree.autocomplete(half) == [('half', 1.0)]
+    tree.remove(prefix[:1])
+    assert len(tree) == 1
+    assert tree.autocomplete([]) == [('other', 3.0)]
+
+
+@pytest.mark.parametrize('tree_class', [SimplePrefixTree,
+                                        CompressedPrefixTree])
+def test_subtree_methods(tree_class: type) -> None:
+    """Test that a subtree can be searched, and that the operations that
+    change a whole tree are only offered by its root.
+    """
+    tree = tree_class('sum')
+    tree.insert('ab', 2.0, ['a', 'b'])
+    tree.insert('ac', 1.0, ['a', 'c'])
+    tree.insert('d', 4.0, ['d'])
+    subtree = tree.subtrees[1]
+    assert subtree.value == ['a']
+    assert len(subtree) == 2
+    assert subtree.autocomplete(['a']) == [('ab', 2.0), ('ac', 1.0)]
+    assert subtree.autocomplete_many([['a', 'c'], ['a', 'x']]) == \
+        [[('ac', 1.0)], []]
+    for name in ['insert', 'remove', 'remove_many', 'contains', 'cursor',
+                 'update_weight', 'remove_value']:
+        assert hasattr(tree, name)
+        assert not hasattr(subtree, name)
+
+
+@pytest.mark.parametrize('tree_class', [SimplePrefixTree,
+                                        CompressedPrefixTree])
+def test_list_values(tree_class: type) -> None:
+    """Test that values which are lists are stored in leaves as they are,
+    and are not mistaken for the prefixes of non-leaf trees.
+    """
+    tree = tree_class('sum')
+    tree.insert(['x'], 1.0, ['a'])
+    tree.insert('y', 2.0, ['a', 'x'])
+    tree.insert(['x'], 2.0, ['a'])
+    tree.insert(['z'], 4.0, ['a', 'x'])
+    assert len(tree) == 3
+    assert tree.autocomplete(['a']) == [(['z'], 4.0), (['x'], 3.0),
+                                        ('y', 2.0)]
+    assert tree.autocomplete(['a', 'x']) == [(['z'], 4.0), ('y', 2.0)]
+    tree.scale_weights(0.5)
+    assert tree.autocomplete(['a']) == [(['z'], 2.0), (['x'], 1.5),
+                                        ('y', 1.0)]
+    tree.update_weight(['x'], 1.0)
+    assert tree.autocomplete(['a'], 1) == [(['x'], 2.5)]
+    tree.remove(['a', 'x'])
+    assert tree.autocomplete([]) == [(['x'], 2.5)]
+    tree.remove_value(['x'])
+    assert len(tree) == 0
+
+
+@pytest.mark.parametrize('tree_class', [SimplePrefixTree,
+                                        CompressedPrefixTree])
+@pytest.mark.parametrize('seed', range(20))
+def test_len_matches_leaf_count(tree_class: type, seed: int) -> None:
+    """Test that len() matches a count of the leaves after every one of a
+    random sequence of inserts and removes.
+
+    The prefixes are drawn from a small alphabet, so that compressed trees
+    are split by inserts and merged by removes over and over.
+    """
+    rng = random.Random(seed)
+    tree = tree_class('sum')
+    for _ in range(200):
+        prefix = [rng.choice('abc') for _ in range(rng.randint(0, 5))]
+        if rng.random() < 0.7:
+            # A value is always inserted with the same prefix.
+            value = ''.join(prefix) + str(rng.randint(0, 2))
+            tree.insert(value, rng.choice([0.5, 1.0, 2.0]), prefix)
+        else:
+            tree.remove(prefix[:3])
+        _check_lengths(tree)
+
+
+@pytest.mark.parametrize('tree_class', [SimplePrefixTree,
+                                        CompressedPrefixTree])
+def test_decay_after_long_idle(tree_class: type) -> None:
+    """Test that a decaying autocompleter still answers and takes inserts
+    after being left idle for far more than 1024 half-lives, when the
+    factor its stored weights would grow by overflows a float.
+    """
+    now = [0.0]
+    autocompleter = DecayingAutocompleter(tree_class('sum'), 60.0,
+                                          lambda: now[0])
+    autocompleter.insert('ab', 5.0, ['a', 'b'])
+    autocompleter.insert('ac', 3.0, ['a', 'c'])
+    now[0] = 18 * 60 * 60.0
+    assert [value for value, _ in autocompleter.autocomplete(['a'])] == \
+        ['ab', 'ac']
+    autocompleter.insert('ad', 2.0, ['a', 'd'])
+    autocompleter.insert('ab', 1.0, ['a', 'b'])
+    assert autocompleter.autocomplete(['a'], 2) == [('ad', 2.0), ('ab', 1.0)]
+    now[0] += 60.0
+    assert autocompleter.autocomplete(['a', 'd']) == [('ad', 1.0)]
+
+
+@pytest.mark.parametrize('tree_class', [SimplePrefixTree,
+                                        CompressedPrefixTree])
+def test_decayed_queries_do_not_change_tree(tree_class: type) -> None:
+    """Test that queries made from several threads at once, long after the
+    stored weights of a decaying autocompleter would need rescaling, all
+    see the same decayed weights and leave the stored weights unchanged.
+    """
+    now = [0.0]
+    tree = tree_class('sum')
+    autocompleter = DecayingAutocompleter(tree, 60.0, lambda: now[0])
+    autocompleter.insert('ab', 4.0, ['a', 'b'])
+    autocompleter.insert('ac', 2.0, ['a', 'c'])
+    now[0] = 40 * 60.0
+    stored = tree.autocomplete([])
+    expected = [('ab', 4.0 * 2.0 ** -40), ('ac', 2.0 * 2.0 ** -40)]
+    results = []
+    barrier = threading.Barrier(8)
+
+    def query() -> None:
+        barrier.wait()
+        for _ in range(50):
+            results.append(autocompleter.autocomplete(['a']))
+            results.append(autocompleter.autocomplete_many([['a']])[0])
+
+    threads = [threading.Thread(target=query) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(results) == 800
+    assert all(result == expected for result in results)
+    assert tree.autocomplete([]) == stored
+
+
+@pytest.mark.parametrize('tree_class', [SimplePrefixTree,
+                                        CompressedPrefixTree])
+@pytest.mark.parametrize('weight_type', ['sum', 'average', 'max'])
+def test_snapshot_round_trip(tree_class: type, weight_type: str,
+                             tmp_path: Any) -> None:
+    """Test that a snapshot loaded with MappedPrefixTree.load answers every
+    query as the tree it was saved from does, and cannot be changed.
+    """
+    tree = tree_class.from_items(weight_type, _random_items(0, 300))
+    path = str(tmp_path / 'tree.snapshot')
+    tree.save(path)
+    mapped = MappedPrefixTree.load(path)
+    assert mapped.weight_type == weight_type
+    assert len(mapped) == len(tree)
+    for prefix in _query_prefixes():
+        for limit in [None, 1, 3]:
+            assert mapped.autocomplete(prefix, limit) == \
+                tree.autocomplete(prefix, limit)
+    with pytest.raises(NotImplementedError):
+        mapped.insert('x', 1.0, ['x'])
+
+
+def test_snapshot_empty_and_invalid(tmp_path: Any) -> None:
+    """Test the snapshot of an empty tree, and loading a file that is not a
+    snapshot.
+    """
+    path = str(tmp_path / 'empty.snapshot')
+    SimplePrefixTree('sum').save(path)
+    mapped = MappedPrefixTree.load(path)
+    assert len(mapped) == 0
+    assert mapped.autocomplete([]) == []
+    other = tmp_path / 'other.bin'
+    other.write_bytes(bytes(128))
+    with pytest.raises(ValueError):
+        MappedPrefixTree.load(str(other))
+
+
+@pytest.mark.parametrize('tree_class', [SimplePrefixTree,
+                                        CompressedPrefixTree])
+@pytest.mark.parametrize('key_length', [1, 2])
+def test_sharded_matches_single_tree(tree_class: type,
+                                     key_length: int) -> None:
+    """Test that a sharded autocompleter keeps every value in the shard its
+    prefix picks, and answers every query as a single tree holding the same
+    values does, through inserts and removes.
+    """
+    items = _random_items(1, 300)
+    sharded = ShardedAutocompleter.from_items(tree_class, 'sum', items[:200],
+                                              3, key_length)
+    tree = tree_class.from_items('sum', items[:200])
+    for value, weight, prefix in items[200:]:
+        sharded.insert(value, weight, prefix)
+        tree.insert(value, weight, prefix)
+    for prefix in [['a', 'b'], ['c']]:
+        sharded.remove(prefix)
+        tree.remove(prefix)
+    assert len(sharded) == len(tree)
+    for i, shard in enumerate(sharded.shards):
+        for value, _ in shard.autocomplete([]):
+            prefix = [element for element in value if element in 'abc']
+            assert shard_index(prefix, key_length, 3) == i
+    for prefix in _query_prefixes():
+        for limit in [None, 1, 3]:
+            assert sharded.autocomplete(prefix, limit) == \
+                tree.autocomplete(prefix, limit)
+    prefixes = _query_prefixes()
+    assert sharded.autocomplete_many(prefixes, 2) == \
+        [tree.autocomplete(prefix, 2) for prefix in prefixes]
+
+
+@pytest.mark.parametrize('tree_class', [SimplePrefixTree,
+                                        CompressedPrefixTree])
+@pytest.mark.parametrize('top_k', [None, 2])
+def test_published_snapshot_is_unchanged(tree_class: type,
+                                         top_k: Optional[int]) -> None:
+    """Test that a tree published by a concurrent autocompleter answers
+    every query as it did when it was published, whatever is inserted or
+    removed afterwards, while the next published tree has the changes.
+    """
+    items = _random_items(2, 200)
+    autocompleter = ConcurrentAutocompleter(
+        tree_class.from_items('sum', items[:150], top_k))
+    expected = tree_class.from_items('sum', items[:150], top_k)
+    snapshot = autocompleter.snapshot()
+    before = [snapshot.autocomplete(prefix, limit)
+              for prefix in _query_prefixes() for limit in [None, 2]]
+    for value, weight, prefix in items[150:]:
+        autocompleter.insert(value, weight, prefix)
+        expected.insert(value, weight, prefix)
+    for value, _, prefix in items[:20]:
+        autocompleter.insert(value, 0.5, prefix)
+        expected.insert(value, 0.5, prefix)
+    for prefix in [['b', 'a'], ['c', 'c', 'c'], ['a']]:
+        autocompleter.remove(prefix)
+        expected.remove(prefix)
+    assert autocompleter.snapshot() is not snapshot
+    assert len(snapshot) == 150
+    assert [snapshot.autocomplete(prefix, limit)
+            for prefix in _query_prefixes() for limit in [None, 2]] == before
+    assert len(autocompleter) == len(expected)
+    for prefix in _query_prefixes():
+        for limit in [None, 2]:
+            assert autocompleter.autocomplete(prefix, limit) == \
+                expected.autocomplete(prefix, limit)
+
+
+@pytest.mark.parametrize('tree_class', [SimplePrefixTree,
+                                        CompressedPrefixTree])
+@pytest.mark.parametrize('seed', range(10))
+def test_remove_many_matches_removes(tree_class: type, seed: int) -> None:
+    """Test that removing a batch of prefixes, which may overlap, repeat or
+    match nothing, leaves a tree that answers every query as removing them
+    one at a time does.
+    """
+    rng = random.Random(seed)
+    items = _random_items(seed, 200)
+    batched = tree_class.from_items('sum', items)
+    one_by_one = tree_class.from_items('sum', items)
+    prefixes = [[rng.choice('abcd') for _ in range(rng.randint(1, 3))]
+                for _ in range(rng.randint(1, 6))]
+    prefixes.append(list(prefixes[0]))
+    batched.remove_many(prefixes)
+    for prefix in prefixes:
+        one_by_one.remove(prefix)
+    _check_lengths(batched)
+    assert len(batched) == len(one_by_one)
+    for prefix in _query_prefixes():
+        assert batched.autocomplete(prefix) == one_by_one.autocomplete(prefix)
+    for value, _, prefix in items[:20]:
+        batched.insert(value, 0.5, prefix)
+        one_by_one.insert(value, 0.5, prefix)
+    assert batched.autocomplete([]) == one_by_one.autocomplete([])
+
+
+@pytest.mark.parametrize('tree_class', [SimplePrefixTree,
+                                        CompressedPrefixTree])
+def test_remove_many_everything(tree_class: type) -> None:
+    """Test that removing a batch that includes the empty prefix empties
+    the tree.
+    """
+    tree = tree_class.from_items('sum', _random_items(3, 50))
+    tree.remove_many([['a'], [], ['b', 'c']])
+    assert len(tree) == 0
+    assert tree.autocomplete([]) == []
+    tree.insert('x', 1.0, ['x'])
+    assert tree.autocomplete([]) == [('x', 1.0)]
+
+
+@pytest.mark.parametrize('tree_class', [SimplePrefixTree,
+                                        CompressedPrefixTree])
+@pytest.mark.parametrize('weight_type', ['sum', 'average', 'max'])
+def test_value_index(tree_class: type, weight_type: str) -> None:
+    """Test contains, update_weight and remove_value, mixed with inserts and
+    removes that keep the value index up to date, against a tree rebuilt
+    from the values that should be left.
+    """
+    rng = random.Random(4)
+    items = _random_items(4, 120)
+    tree = tree_class.from_items(weight_type, items[:100])
+    assert tree.contains(items[0][0])
+    assert not tree.contains(items[100][0])
+    model = {value: [weight, prefix] for value, weight, prefix in items[:100]}
+    for value, weight, prefix in items[100:]:
+        tree.insert(value, weight, prefix)
+        model[value] = [weight, prefix]
+    for value, _, _ in rng.sample(items, 40):
+        if value in model and rng.random() < 0.5:
+            delta = rng.choice([0.25, -0.25])
+            tree.update_weight(value, delta)
+            model[value][0] += delta
+        else:
+            tree.remove_value(value)
+            model.pop(value, None)
+    tree.remove(['a', 'b'])
+    tree.remove_many([['c', 'a'], ['b', 'b', 'b']])
+    for value in list(model):
+        prefix = model[value][1]
+        if prefix[:2] in [['a', 'b'], ['c', 'a']] or prefix[:3] == ['b'] * 3:
+            del model[value]
+    for value, _, _ in items:
+        assert tree.contains(value) == (value in model)
+    expected = tree_class.from_items(
+        weight_type, [(value, weight, prefix)
+                      for value, (weight, prefix) in model.items()])
+    assert len(tree) == len(expected)
+    for prefix in _query_prefixes():
+        assert [value for value, _ in tree.autocomplete(prefix)] == \
+            [value for value, _ in expected.autocomplete(prefix)]
+    _check_lengths(tree)
+
+
+def test_value_index_key() -> None:
+    """Test a value index keyed by a function of unhashable values, and that
+    inserting a value already in the tree adds to its weight.
+    """
+    tree = SimplePrefixTree('sum')
+    tree.index_values(key=lambda value: value['id'])
+    tree.insert({'id': 1}, 1.0, ['a'])
+    tree.insert({'id': 2}, 2.0, ['a', 'b'])
+    tree.insert({'id': 1}, 2.0, ['a'])
+    assert len(tree) == 2
+    assert tree.autocomplete(['a']) == [({'id': 1}, 3.0), ({'id': 2}, 2.0)]
+    tree.update_weight({'id': 2}, 2.0)
+    assert tree.autocomplete(['a'], 1) == [({'id': 2}, 4.0)]
+    tree.remove_value({'id': 2})
+    tree.remove_value({'id': 3})
+    assert not tree.contains({'id': 2})
+    assert tree.autocomplete([]) == [({'id': 1}, 3.0)]
+
+
+if __name__ == '__main__':
+    pytest.main(['test_prefix_tree.py'])